@@ -1,83 +1,159 @@
-from langchain_core.messages import HumanMessage
-from openai import OpenAI
-import os
-from utils.url_parser import group_urls
+from concurrent.futures import Future, ThreadPoolExecutor
+from utils.cache import make_key, normalize_query
+from utils.clients import get_client
+from utils.concurrency import api_slot
+from utils.llm_cache import LLMCache
+from utils.operator import DecisionPending, get_operator
+from utils.state import get_search_query
+from utils.tracing import external_call, in_current_context, record_openai_usage, set_span_attribute
+from utils.url_parser import group_search_results
 
 
 class AnalyzeSearch:
     """
-    The AnalyzeSearch class is responsible for analyzing the search results and determining if the user 
-    is satisfied with the results.It uses the OpenAI API to generate a summary of the search results and 
+    The AnalyzeSearch class is responsible for analyzing the search results and determining if the user
+    is satisfied with the results.It uses the OpenAI API to generate a summary of the search results and
     prompts the user to confirm if the results are satisfactory.If the user is not satisfied, the search is reset.
 
     In some cases, search results will return multiple companies that are similar or have the same name.
     We introduce a human in the loop to help the agent determine the correct company from the search results.
+
+    The summaries for every group are requested concurrently (at most max_concurrency at a time) as soon as
+    the groups are known, and are shown to the user in ranked order as they finish, so the user only waits
+    for a single LLM round trip instead of one per rejected group.
+
+    Summaries are kept in the state (group_summaries), when the same query comes back after a reset, a failed
+    focused search or a suspended run (see ServiceOperator) the groups already summarized are not sent to
+    the LLM again. Across runs the completions are reused from the LLM cache (see LLMCache), bypassed with
+    regenerate.
+
+    With merge_similar_groups, groups on different domains with near identical content are merged before
+    summarizing, which saves a summary and a question to the user for each merged group.
+
+    With a speculator (see FocusSpeculator), the focused search and extraction for a group start as soon as
+    its summary is shown. They are waited for when the user answers 'yes' and cancelled on 'no' or 'reset'.
+    While the run is suspended on the question they keep going, so the responses are cached when it resumes.
     """
-    def __init__(self):
-        self.openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-    
-    def analyze_search(self,state):
-        search_results = state.get("search_results", [])
-        search_query = [message for message in state['messages'] if type(message) == HumanMessage][-1].content
-        # Group the search results by url to help group but similar companies into the same group for better summaries.
-        result = group_urls([site.metadata['url'] for site in search_results])
-        sort_results =  dict(sorted(result.items(), key=lambda item: len(item[1]), reverse=True))
-        search_result_groups = [[result for result in search_results if result.metadata['url'] in group] for group in sort_results.values()]
-        
-        for search_result in search_result_groups:
-            summary_prompt = f"""Provide a summary of the search results found for the user query "{search_query}".
-            Search Results:
-            {search_result}
-            present the output as follows:
-            Company Name: Company Summary
-            """
+    model = "gpt-3.5-turbo"
+    system_prompt = "You are a critical analyst tasked with providing a general summary of the company found in the search results"
+
+    def __init__(self, max_concurrency=8, merge_similar_groups=False, speculator=None, cache=None, regenerate=False):
+        self.openai_client = get_client('openai')
+        self.llm_cache = LLMCache(cache, bypass=regenerate)
+        self.max_concurrency = max_concurrency
+        self.merge_similar_groups = merge_similar_groups
+        self.speculator = speculator
+
+    @staticmethod
+    def format_results(search_result):
+        # What the model needs of each result, the bookkeeping fields of SearchResult would only cost tokens
+        return "\n".join(f"- {result.url} (score {result.score or 0:.2f}): {result.content}" for result in search_result)
+
+    def summarize_group(self, search_query, search_result):
+        summary_prompt = f"""Provide a summary of the search results found for the user query "{search_query}".
+        Search Results:
+        {self.format_results(search_result)}
+        present the output as follows:
+        Company Name: Company Summary
+        """
+        return self.llm_cache.complete(self.llm_cache.key(self.model, self.system_prompt, summary_prompt),
+                                       lambda: self._summarize(summary_prompt))
+
+    def _summarize(self, summary_prompt):
+        with api_slot('openai'), external_call('openai.chat'):
             summary_response = self.openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
+                model=self.model,
                 messages=[
-                    {"role": "system", "content": "You are a critical analyst tasked with providing a general summary of the company found in the search results"},
+                    {"role": "system", "content": self.system_prompt},
                     {"role": "user", "content": summary_prompt}
                 ]
             )
-            summary = summary_response.choices[0].message.content
-            print("\n🔍 **Company Search Result**\n")
-            print(f"📄 {summary}\n")
-
-            # Prompt the user to confirm if the summary is for the correct company
-            while True:
-                user_input = input(
-                    "\n🔍 Is this the company you were looking for?\n"
-                    "➡️ Type 'yes' to generate a more detailed summary.\n"
-                    "➡️ Type 'no' if this is not the correct company.\n"
-                    "➡️ Type 'reset' to reset the search.\n"
-                    "📝 Your answer: "
-                )
+        record_openai_usage(summary_response)
+        return summary_response.choices[0].message.content
+
+    @staticmethod
+    def _completed(summary):
+        future = Future()
+        future.set_result(summary)
+        return future
+
+    def analyze_search(self, state, config=None):
+        operator = get_operator(config)
+        search_results = state.get("search_results", [])
+        search_query = get_search_query(state)
+        # Group the search results by url to help group but similar companies into the same group for better summaries.
+        search_result_groups = group_search_results(search_results, merge_similar=self.merge_similar_groups)
+
+        user_input = ''
+        group_summaries = dict(state.get('group_summaries') or {})
+        group_keys = [make_key('group_summary', query=normalize_query(search_query), urls=[result.url for result in search_result])
+                      for search_result in search_result_groups]
+        # Fire every group summary not generated before at once, the user reviews them in ranked order while the rest finish.
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(search_result_groups))))
+        summaries = [self._completed(group_summaries[key]) if key in group_summaries
+                     else executor.submit(in_current_context(self.summarize_group), search_query, search_result)
+                     for key, search_result in zip(group_keys, search_result_groups)]
+        budget = self.speculator.new_budget() if self.speculator is not None else None
+        speculation = None
+        try:
+            for search_result, pending_summary in zip(search_result_groups, summaries):
+                summary = pending_summary.result()
+                print("\n🔍 **Company Search Result**\n")
+                print(f"📄 {summary}\n")
+
+                if self.speculator is not None:
+                    # Search and extract for this company while the user reads, the groups rejected so far are excluded
+                    exclude_domains = [result.url for result in search_results if result.relevance == 'no']
+                    speculation = self.speculator.start(search_query, summary, exclude_domains, budget)
+
+                # Ask the user (or the batch operator) to confirm if the summary is for the correct company
+                try:
+                    user_input = operator.confirm_company(summary, [result.url for result in search_result])
+                except DecisionPending:
+                    # The run is suspended until the user answers, the speculation fills the cache meanwhile
+                    speculation = None
+                    raise
+                if speculation is not None:
+                    # Keep the speculative responses only for the confirmed company
+                    if user_input == 'yes':
+                        speculation.wait()
+                    else:
+                        speculation.cancel()
+                    speculation = None
                 if user_input in ['yes', 'no']:
                     # Update the search results with the user's confirmation
                     # and add the summary to the result
                     for result in search_result:
-                        result.metadata['relevance'] = user_input
-                        result.metadata['summary'] = summary
-                    break
-                elif user_input == 'reset':
+                        result.relevance = user_input
+                        result.summary = summary
+                if user_input == 'yes' or user_input == 'reset':
                     break
-                else:
-                    print("Invalid input. Please try again.")
-            if user_input == 'yes' or user_input == 'reset':
-                break
+        finally:
+            # Summaries the user never got to are not needed anymore
+            executor.shutdown(wait=False, cancel_futures=True)
+            if speculation is not None:
+                speculation.cancel()
+            if budget is not None:
+                set_span_attribute('speculative_tavily_calls', budget.spent)
+            # Remember every summary that was paid for, shown or not
+            for key, pending_summary in zip(group_keys, summaries):
+                if pending_summary.done() and not pending_summary.cancelled() and pending_summary.exception() is None:
+                    group_summaries[key] = pending_summary.result()
+            state['group_summaries'] = group_summaries
 
         # Check if all results were marked as irrelevant
-        num_of_irrelevant_results = [result for result in search_results if result.metadata['relevance'] == 'no']
+        num_of_irrelevant_results = [result for result in search_results if result.relevance == 'no']
         # If all results were marked as irrelevant, prompt the user to try again with more details
         if len(num_of_irrelevant_results) == len(search_results):
             print("*************************************************************************************************************************")
             print("It seems none of the results matched the company you were looking for. Please try your search again and add more details.")
             print("*************************************************************************************************************************")
-            state['messages'].append('tavily_search')  # Reset to the starting node
+            state['route'] = 'tavily_search'  # Reset to the starting node
         # If the user input is reset, prompt the user to try again with more details
         elif user_input == 'reset':
             print('\n!!!! Please be more descriptive when entering the company you want to research !!!!\n')
-            state['messages'].append('tavily_search')
+            state['route'] = 'tavily_search'
         else:
-            state['messages'].append('tavily_focused_search')
+            state['route'] = 'tavily_focused_search'
 
         return state
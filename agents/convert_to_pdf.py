@@ -1,68 +1,140 @@
-import markdown2
+from collections import OrderedDict
 import os
 from langchain_core.messages import AIMessage
 import re
-from xhtml2pdf import pisa  # Import xhtml2pdf for HTML to PDF conversion
+import threading
+from utils.operator import get_operator
+from utils.render_pool import check_formats, get_render_pool, render_report
+from utils.state import get_search_query
 
 class ConvertToPDF:
     """
     The ConvertToPDF class is responsible for converting the final summary to a PDF.
     It uses the xhtml2pdf library to convert the markdown to a PDF.
+
+    formats: The files written for each report, any of 'pdf', 'html' and 'md' (the markdown itself).
+    background: Render in the shared process pool instead of inside the graph. The graph moves on as soon as
+                the render is submitted, jobs[report_path] holds its future and drain() waits for all of them.
+                The renders that succeeded are dropped from jobs when the next one is submitted, their report
+                is on disk, the failed ones are kept until taken out of jobs (see BatchResearcher and
+                ResearchService.get_report).
+
+    A node run again for the same thread and step (after the service suspended it on the "another company?"
+    question) gets the report it already rendered instead of a second copy. The report is forgotten once the
+    question is answered, at most max_suspended of the suspended nodes are remembered.
+
+    With a report_store (refresh mode), the report and the pages it was written from are recorded for the next
+    refresh, and a report identical to the last one of the company is not rendered again.
     """
-    def __init__(self, save_dir='pdfs'):
+    def __init__(self, save_dir='pdfs', formats=('pdf',), background=True, render_pool=None, report_store=None,
+                 max_suspended=1024):
         self.save_dir = save_dir
+        self.formats = check_formats(formats)
+        self.background = background
+        self.render_pool = render_pool
+        self.jobs = {}
+        self.report_store = report_store
+        self.max_suspended = max_suspended
         os.makedirs(self.save_dir, exist_ok=True)  # Ensure the save directory exists
+        self._filename_lock = threading.Lock()  # Concurrent batch runs may produce reports with the same name
+        self._reports = OrderedDict()  # (thread id, graph step) -> report path, oldest first
 
-    def convert(self, state):
+    def convert(self, state, config=None):
         # Extract the markdown content from the last AI message
         markdown_content = [message.content for message in state['messages'] if type(message) == AIMessage][-1]
-        
-        # Convert markdown to HTML
-        html_content = markdown2.markdown(markdown_content)
-        
+
         # Use the company name from the state to name the PDF
         company_name_match = re.search(r"^# (.+)", markdown_content, re.MULTILINE)
         company_name = company_name_match.group(1) if company_name_match else "Company"
-        output_path = self._get_unique_filename(company_name)
-        
-        # Convert HTML to PDF using xhtml2pdf
-        self._convert_html_to_pdf(html_content, output_path)
-        
-        print(f"\n✅ PDF generated successfully: {output_path}")
-        
-        # Prompt the user to search for another company or end the workflow
-        while True:
-                user_input = input(
-                "\n🔍 Would you like to search for another company?\n"
-                "➡️ Type 'yes' to generate a more detailed summary.\n"
-                "➡️ Type 'no' if this is not the correct company.\n"
-                "📝 Your answer: ")
-                if user_input in ['yes', 'no']:
-                    break
-                else:
-                    print("Invalid input. Please try again.")
+        report_key = ((config or {}).get('configurable', {}).get('thread_id'),
+                      (config or {}).get('metadata', {}).get('langgraph_step'))
+        with self._filename_lock:
+            output_path = self._reports.get(report_key) if None not in report_key else None
+        if output_path is None:
+            output_path = self._unchanged_report(state, markdown_content) or self._render(markdown_content, company_name)
+            with self._filename_lock:
+                self._reports[report_key] = output_path
+                while len(self._reports) > self.max_suspended:
+                    self._reports.popitem(last=False)
+        if self.report_store is not None:
+            self.report_store.save(get_search_query(state), output_path, markdown_content, state.get('search_results', []))
+        state['report_path'] = output_path
+
+        # Ask the user (or the batch operator) to search for another company or end the workflow
+        user_input = get_operator(config).ask_search_another(report_path=output_path)
+        with self._filename_lock:
+            self._reports.pop(report_key, None)
         if user_input == 'yes':
-            state['messages'].append('search')  # Reset to the starting node
+            state['route'] = 'search'  # Reset to the starting node
         else:
-            state['messages'].append('end')
+            state['route'] = 'end'
 
         return state
 
-    def _convert_html_to_pdf(self, source_html, output_filename):
-        # Convert HTML to PDF using xhtml2pdf
-        with open(output_filename, "w+b") as result_file:
-            pisa_status = pisa.CreatePDF(source_html, dest=result_file)
-        return pisa_status.err
-
-    def _get_unique_filename(self, base_name):
-        # Generate a unique filename by appending a number if necessary
-        base_path = os.path.join(self.save_dir, f"{base_name}.pdf")
-        if not os.path.exists(base_path):
-            return base_path
-        
-        counter = 2
-        while True:
-            new_path = os.path.join(self.save_dir, f"{base_name}_{counter}.pdf")
-            if not os.path.exists(new_path):
-                return new_path
-            counter += 1
+    def _unchanged_report(self, state, markdown_content):
+        # The last report of the company if it is the same report and still on disk
+        if self.report_store is None:
+            return None
+        previous = self.report_store.load(get_search_query(state))
+        if previous is None or previous['markdown'] != markdown_content or not os.path.exists(previous['report_path']):
+            return None
+        print(f"\n♻️ Report unchanged: {previous['report_path']}")
+        return previous['report_path']
+
+    def _render(self, markdown_content, company_name):
+        output_base = self._get_unique_basename(company_name)
+        output_path = f"{output_base}.{self.formats[0]}"
+
+        if self.background:
+            # Render in the pool, the graph does not wait for it
+            if self.render_pool is None:
+                self.render_pool = get_render_pool()
+            for path, job in list(self.jobs.items()):
+                if job.done() and not job.cancelled() and job.exception() is None:
+                    self.jobs.pop(path, None)
+            self.jobs[output_path] = self.render_pool.submit(markdown_content, output_base, self.formats)
+            print(f"\n⏳ Rendering report in the background: {output_path}")
+        else:
+            render_report(markdown_content, output_base, self.formats)
+            print(f"\n✅ PDF generated successfully: {output_path}")
+        return output_path
+
+    def warm_up(self):
+        """
+        Starts a render worker ahead of the report, so the render begins right away when the report is done.
+        """
+        if self.background:
+            if self.render_pool is None:
+                self.render_pool = get_render_pool()
+            self.render_pool.warm_up()
+
+    def drain(self, timeout=None):
+        """
+        Waits for the background renders of this agent, returns the report paths that are not done yet.
+        """
+        if self.render_pool is not None:
+            self.render_pool.drain(timeout)
+        return [path for path, job in self.jobs.items() if not job.done()]
+
+    def _get_unique_basename(self, base_name):
+        # Generate a unique filename (without extension) by appending a number if necessary
+        with self._filename_lock:
+            base_path = os.path.join(self.save_dir, base_name)
+            if not self._exists(base_path):
+                return self._reserve(base_path)
+
+            counter = 2
+            while True:
+                new_path = os.path.join(self.save_dir, f"{base_name}_{counter}")
+                if not self._exists(new_path):
+                    return self._reserve(new_path)
+                counter += 1
+
+    def _exists(self, base_path):
+        return any(os.path.exists(f"{base_path}.{report_format}") for report_format in self.formats)
+
+    def _reserve(self, base_path):
+        # Create the files right away so no other run picks the same name before the report is written
+        for report_format in self.formats:
+            open(f"{base_path}.{report_format}", 'wb').close()
+        return base_path
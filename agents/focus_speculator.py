@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from utils.tracing import in_current_context
+import logging
+import threading
+
+
+class SpeculationBudget:
+    """
+    Caps the Tavily calls made speculatively while one set of search results is analyzed.
+    """
+    def __init__(self, max_calls):
+        self.max_calls = max_calls
+        self.spent = 0
+        self._lock = threading.Lock()
+
+    def take(self, calls):
+        # Returns how many of the calls are allowed
+        with self._lock:
+            allowed = max(0, min(calls, self.max_calls - self.spent))
+            self.spent += allowed
+            return allowed
+
+
+class Speculation:
+    """
+    A focused search and extraction running ahead of the operator's answer.
+    wait() lets it finish so the next nodes find its responses in the cache, cancel() stops it before its
+    next Tavily call.
+    """
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self.future = None
+
+    def wait(self):
+        if self.future is not None:
+            wait([self.future])
+
+    def cancel(self):
+        self.cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+
+class FocusSpeculator:
+    """
+    The FocusSpeculator runs the focused search and the extraction for a group of search results while the
+    operator is still reading its summary, so the think time hides the latency of the next two nodes.
+
+    Both go through the response cache: if the operator confirms the group, the TavilyFocusedSearch and
+    TavilyExtract nodes find the responses there, otherwise they are left unused. The Tavily calls made
+    speculatively per analysis are capped by max_calls, extraction batches over the cap are left to the
+    extract node.
+    """
+    def __init__(self, focused_search, extract, max_calls=6, max_workers=2):
+        self.focused_search = focused_search
+        self.extract = extract
+        self.max_calls = max_calls
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def new_budget(self):
+        return SpeculationBudget(self.max_calls)
+
+    def start(self, search_query, summary, exclude_domains, budget):
+        """
+        Starts the focused search the graph runs next if the operator confirms the group with this summary,
+        excluding the urls of the groups rejected so far.
+        """
+        speculation = Speculation()
+        speculation.future = self._executor.submit(in_current_context(self._run), speculation,
+                                                   self.focused_search.focused_query(search_query, summary),
+                                                   exclude_domains, budget)
+        return speculation
+
+    def _run(self, speculation, query, exclude_domains, budget):
+        if speculation.cancelled.is_set() or not budget.take(1):
+            return
+        try:
+            response = self.focused_search.cached_search(query, exclude_domains)
+        except Exception as e:
+            logging.error("An error occurred during a speculative focused search: %s", e)
+            return
+        if speculation.cancelled.is_set():
+            return
+        batches = self.extract.batches([result['url'] for result in response['results']])
+        self.extract.prefetch(batches[:budget.take(len(batches))], speculation.cancelled)
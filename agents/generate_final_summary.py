@@ -1,8 +1,17 @@
-from langchain_core.messages import AIMessage, HumanMessage
-from openai import OpenAI
-import os
-import tiktoken
+from langchain_core.messages import AIMessage
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import re
+import time
+from utils.blob_store import get_default_blob_store
+from utils.clients import get_client
+from utils.concurrency import api_slot
+from utils.dedup import deduplicate
+from utils.llm_cache import LLMCache
+from utils.markdown_stream import MarkdownSectionTracker, join_sections, split_sections
+from utils.passage_ranker import rank_passages
+from utils.state import get_search_query
+from utils.tracing import external_call, in_current_context, record_openai_usage, set_span_attribute
+from utils.token_budget import encode_all, get_tokenizer, pack_by_priority
 from pdb import set_trace as bp
 
 class GenerateFinalSummary:
@@ -14,19 +23,75 @@ class GenerateFinalSummary:
     The current model only has a context window of 16385 tokens and max token output of 4096 tokens. 
     This will limit the number of website extractions that can be added to the prompt as well as the amount of
     detial the model can provide in it's response.
-    
+
+    Modes:
+    single: The highest scoring extracts are packed into a single prompt, what does not fit is left out.
+            With passage_ranking ('bm25' or 'embedding', which needs sentence-transformers), the extracts are
+            split into passages scored against the query and the confirmed company summary instead, and the
+            most relevant passages are packed, in page order.
+    map_reduce: Every extract (split into chunks of chunk_tokens) is condensed into notes for the report sections
+                in parallel, max_concurrency calls at a time. The notes are merged until they fit the context
+                window and the report is written from the notes, so all of the extracted content is used.
+    sections: The content is selected as in single mode (for the longest section prompt) and every section of
+              report_sections is written from it concurrently, with its own prompt and completion tokens, along
+              with the title (the company name, from the summary the user confirmed). The sections are joined in
+              order, so generating the report takes as long as its longest section and each section gets the
+              completion tokens a whole report would have in single mode.
+
+    With stream, the report is printed as it is generated. The time to the first token (ttft_seconds) and the
+    time each markdown section was complete (section_seconds) are recorded in the tracing span, and
+    on_first_token is called once the first token arrives (e.g. to start a render worker).
+
+    With a report_store (refresh mode), a company researched before is not written again from scratch. If no page
+    changed since its last report, the report is kept as it is. Otherwise the passages most relevant to each
+    section of the last report are selected (section_tokens per section) and only the sections drawing on a
+    changed page are rewritten from them, concurrently. state['report_status'] says which it was: 'new',
+    'updated' or 'unchanged'.
+
+    Every completion (report, notes, merged notes and refreshed sections) goes through the LLM cache (see
+    LLMCache), so the same extracts give back the same report without calling the LLM again, and a cached
+    report is printed at once when streaming. regenerate bypasses it.
+
+    With dedup, paragraphs repeated across extracts (syndicated press releases, mirrored profiles, boilerplate)
+    are removed before token counting, keeping the copy from the highest scoring extract.
     """
-    def __init__(self):
-        self.openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-        self.tokenizer = tiktoken.encoding_for_model("gpt-3.5-turbo") # Use the appropriate model encoding
+    model = "gpt-3.5-turbo"
+    system_prompt = "You are a helpful assistant that provides detailed and accurate summaries of a specific company based on search results."
+    notes_system_prompt = "You are a research assistant that takes concise and accurate notes about a specific company from website content."
+    message_overhead_tokens = 20  # Tokens the chat format adds around the system and user messages
+    # GPT-3.5 Turbo has a context window of 16385 tokens
+    context_window = 16385
+    completion_tokens = 4000 #  GPT-3.5 Turbo has a 4,096 max token output (round to be safe)
+    section_tokens = 3000  # Content tokens sent to rewrite one section when refreshing
+    section_completion_tokens = 1000
+    # The sections of the report written concurrently in sections mode: title, what it covers, completion tokens
+    report_sections = [("Company Summary", "Provide a brief overview of the company.", 1000),
+                       ("Key Products", "List and describe the key products or services offered by the company.", 3000),
+                       ("Market", "Describe the market in which the company competes, including any relevant competitors or industry trends.", 3000)]
+    title_completion_tokens = 20
 
-    def generate_answer(self, state):
-        search_results = state.get("search_results", [])
-        search_query = [message for message in state['messages'] if type(message) == HumanMessage][-1].content
-        # Get the raw content of the search results
-        extract = [result.metadata['raw_content'] for result in search_results if result.metadata['raw_content']] 
-        # Calculate token count for the extract
-        prompt = f"""Based on the following raw website content, provide a detailed summary of the company mentioned in the query: "{search_query}". 
+    def __init__(self, mode='single', max_concurrency=4, chunk_tokens=6000, notes_tokens=800, dedup=True, passage_ranking='bm25',
+                 stream=False, on_first_token=None, blob_store=None, report_store=None, cache=None, regenerate=False):
+        self.openai_client = get_client('openai')
+        self.llm_cache = LLMCache(cache, bypass=regenerate)
+        self.blob_store = blob_store or get_default_blob_store()
+        self.report_store = report_store
+        self.mode = mode
+        self.max_concurrency = max_concurrency
+        self.chunk_tokens = chunk_tokens
+        self.notes_tokens = notes_tokens
+        self.dedup = dedup
+        self.passage_ranking = passage_ranking
+        self.stream = stream
+        self.on_first_token = on_first_token
+
+    @property
+    def tokenizer(self):
+        # Loaded on first use and shared by every instance
+        return get_tokenizer(self.model) # Use the appropriate model encoding
+
+    def report_prompt(self, search_query, source="raw website content"):
+        return f"""Based on the following {source}, provide a detailed summary of the company mentioned in the query: "{search_query}". 
         Please include the following sections in markdown format, ensure the company's name is included as markdown documnet title:
         
         # Company Name
@@ -57,34 +122,317 @@ class GenerateFinalSummary:
         Now, using the format above, provide the summary for the company mentioned in the query.
 
         Search Results:"""
-        
-        extract_token_count = sum(len(self.tokenizer.encode(result)) for result in extract)
-        # GPT-3.5 Turbo has a context window of 16385 tokens
-        max_tokens = 16385
-        completion_tokens = 4000 #  GPT-3.5 Turbo has a 4,096 max token output (round to be safe)
-        available_tokens = max_tokens - completion_tokens
-
-        extract_token_count = extract_token_count + len(self.tokenizer.encode(prompt))
-        # Adjust extract size if necessary
-        while extract_token_count > available_tokens:
-            extract.pop()  # Remove the last item
-            extract_token_count = sum(len(self.tokenizer.encode(result)) for result in extract)
 
-        prompt = prompt + "\n" + "\n".join(extract)
+    def notes_prompt(self, search_query, content):
+        return f"""Take notes on the company mentioned in the query: "{search_query}" from the following website content.
+        Only keep facts about this company and group them as bullet points under the markdown headings below,
+        leave a heading empty if the content has nothing for it:
 
-        llm_response = self.openai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that provides detailed and accurate summaries of a specific company based on search results."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=completion_tokens
-        )
-        
-        answer = llm_response.choices[0].message.content
+        ## Company Summary
+        ## Key Products
+        ## Market
+
+        Website Content:
+        {content}"""
+
+    def merge_notes_prompt(self, search_query, notes):
+        notes = "\n\n".join(notes)
+        return f"""Merge the following research notes on the company mentioned in the query: "{search_query}" into a single
+        set of notes under the same markdown headings (## Company Summary, ## Key Products, ## Market).
+        Remove repeated facts but keep every distinct fact.
+
+        Research Notes:
+        {notes}"""
+
+    def write_section_prompt(self, search_query, title, description):
+        return f"""Based on the following raw website content, write the "{title}" section of a detailed markdown report
+        on the company mentioned in the query: "{search_query}".
+        {description}
+        Answer with the text of the section only, in markdown, without its heading. Only use information about this company.
+
+        Search Results:"""
+
+    def title_prompt(self, search_query, content):
+        return f"""What is the name of the company mentioned in the query: "{search_query}"?
+        Answer with the company name only, as it is written in the content below.
+
+        Content:
+        {content}"""
+
+    def section_prompt(self, search_query, title, text, content):
+        return f"""Update the "{title}" section of a markdown report on the company mentioned in the query: "{search_query}"
+        using the website content below. Keep what is still accurate, add what is new and remove what the content
+        contradicts. Answer with the text of the section only, in markdown, without its heading.
+
+        Current Section:
+        {text}
 
+        Website Content:
+        {content}"""
+
+    def _complete(self, system_prompt, prompt, max_tokens):
+        return self.llm_cache.complete(self.llm_cache.key(self.model, system_prompt, prompt, max_tokens=max_tokens),
+                                       lambda: self._create(system_prompt, prompt, max_tokens))
+
+    def _create(self, system_prompt, prompt, max_tokens):
+        with api_slot('openai'), external_call('openai.chat'):
+            llm_response = self.openai_client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=max_tokens
+            )
+        record_openai_usage(llm_response)
+        return llm_response.choices[0].message.content
+
+    def _complete_stream(self, system_prompt, prompt, max_tokens):
+        # Print the completion as it streams in, noting when the first token arrived and when each section was done.
+        # A cached completion is printed at once.
+        key = self.llm_cache.key(self.model, system_prompt, prompt, max_tokens=max_tokens)
+        start = time.perf_counter()
+        answer = self.llm_cache.get(key)
+        if answer is not None:
+            set_span_attribute('ttft_seconds', round(time.perf_counter() - start, 6))
+            if self.on_first_token is not None:
+                self.on_first_token()
+            print(answer)
+            return answer
+        sections = MarkdownSectionTracker()
+        section_seconds = {}
+        parts = []
+        with api_slot('openai'), external_call('openai.chat'):
+            stream = self.openai_client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=max_tokens,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            for chunk in stream:
+                # The last chunk has no choices, only the usage of the whole completion
+                if getattr(chunk, 'usage', None) is not None:
+                    record_openai_usage(chunk)
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                if not parts:
+                    set_span_attribute('ttft_seconds', round(time.perf_counter() - start, 6))
+                    if self.on_first_token is not None:
+                        self.on_first_token()
+                parts.append(delta)
+                print(delta, end="", flush=True)
+                for title, _ in sections.feed(delta):
+                    section_seconds[title] = round(time.perf_counter() - start, 6)
+        for title, _ in sections.close():
+            section_seconds[title] = round(time.perf_counter() - start, 6)
+        print()
+        set_span_attribute('section_seconds', section_seconds)
+        answer = "".join(parts)
+        self.llm_cache.set(key, answer)
+        return answer
+
+    def _prompt_budget(self, prompt, system_prompt, completion_tokens):
+        # Tokens left for content once the prompt, the system message and the completion are accounted for
+        prompt_token_count = len(self.tokenizer.encode(prompt + "\n" + system_prompt, disallowed_special=()))
+        return self.context_window - completion_tokens - self.message_overhead_tokens - prompt_token_count
+
+    def _deduplicate(self, extracts):
+        # Drop passages repeated across extracts and report how many tokens that saved
+        extracts, removed = deduplicate(extracts)
+        saved_tokens = sum(len(tokens) for tokens in encode_all(self.tokenizer, removed))
+        set_span_attribute('dedup_removed_passages', len(removed))
+        set_span_attribute('dedup_saved_tokens', saved_tokens)
+        if removed:
+            print(f"🧹 Removed {len(removed)} duplicate passages ({saved_tokens} tokens)")
+        return extracts
+
+    def _select_extracts(self, prompt, extracts, scores, completion_tokens=None):
+        # Tokenize every extract once and pack the highest scoring ones into what is left after the prompt,
+        # the last one that does not fit entirely is truncated instead of dropped.
+        extract, _ = pack_by_priority(self.tokenizer, extracts, scores,
+                                      self._prompt_budget(prompt, self.system_prompt, completion_tokens or self.completion_tokens))
+        return extract
+
+    def _select_passages(self, prompt, extracts, ranking_query, completion_tokens=None):
+        # Score every passage against the query and pack the most relevant ones, kept in page order so
+        # passages from the same page stay together
+        passages, scores, _ = rank_passages(extracts, ranking_query, method=self.passage_ranking)
+        selected, _ = pack_by_priority(self.tokenizer, passages, scores,
+                                       self._prompt_budget(prompt, self.system_prompt, completion_tokens or self.completion_tokens),
+                                       keep_order=True)
+        set_span_attribute('ranked_passages', len(passages))
+        set_span_attribute('selected_passages', len(selected))
+        return selected
+
+    def _refresh(self, previous, search_query, extracted, extracts):
+        # Brings the last report up to date with the changed pages, returns the report and its status
+        # ('unchanged' or 'updated'), or (None, 'new') when it has to be written from scratch
+        preamble, sections = split_sections(previous['markdown'])
+        if not sections:
+            return None, 'new'
+        changed = {index for index, result in enumerate(extracted)
+                   if previous['pages'].get(result.url, {}).get('content') != result.raw_content_key}
+        set_span_attribute('changed_pages', len(changed))
+        if not changed:
+            print("♻️ No page changed since the last report, keeping it")
+            return previous['markdown'], 'unchanged'
+
+        # Every section is rewritten from its most relevant passages if one of them comes from a changed page
+        updates = {}
+        passage_tokens = None
+        for title, text in sections:
+            passages, scores, positions = rank_passages(extracts, f"{search_query} {title} {text}", method=self.passage_ranking or 'bm25')
+            if passage_tokens is None:
+                passage_tokens = [len(tokens) + 1 for tokens in encode_all(self.tokenizer, passages)]
+            selected, used = [], 0
+            for index in sorted(range(len(passages)), key=lambda index: scores[index], reverse=True):
+                if scores[index] <= 0 or used + passage_tokens[index] > self.section_tokens:
+                    break
+                selected.append(index)
+                used += passage_tokens[index]
+            if any(positions[index][0] in changed for index in selected):
+                content = "\n".join(passages[index] for index in sorted(selected))
+                updates[title] = self.section_prompt(search_query, title, text, content)
+        set_span_attribute('refreshed_sections', list(updates))
+        if not updates:
+            print("♻️ The changed pages do not affect the report, keeping it")
+            return previous['markdown'], 'unchanged'
+
+        print(f"♻️ Updating {', '.join(updates)}")
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            rewritten = dict(zip(updates, executor.map(
+                in_current_context(lambda prompt: self._complete(self.system_prompt, prompt, self.section_completion_tokens)),
+                updates.values())))
+        rewritten = {title: self._strip_heading(title, text) for title, text in rewritten.items()}
+        return join_sections(preamble, [(title, rewritten.get(title, text).strip()) for title, text in sections]), 'updated'
+
+    @staticmethod
+    def _strip_heading(title, text):
+        # The model sometimes repeats the heading it was asked to leave out
+        return re.sub(rf"^#+\s*{re.escape(title)}\s*\n", "", text.strip()).strip()
+
+    def _select_context(self, prompt, search_query, extracted, extracts, scores, completion_tokens=None):
+        # The content that fits in the prompt, ranked passages or the highest scoring extracts
+        if self.passage_ranking:
+            # The summary the user confirmed in the analysis describes the company being researched
+            summaries = list(dict.fromkeys(result.summary for result in extracted if result.summary))
+            return self._select_passages(prompt, extracts, " ".join([search_query] + summaries), completion_tokens)
+        return self._select_extracts(prompt, extracts, scores, completion_tokens)
+
+    def _map_notes(self, executor, search_query, extracts):
+        # Split every extract into chunks that fit a notes prompt and condense them all concurrently
+        chunks = []
+        for tokens in encode_all(self.tokenizer, extracts):
+            for start in range(0, len(tokens), self.chunk_tokens):
+                chunks.append(self.tokenizer.decode(tokens[start:start + self.chunk_tokens]))
+        prompts = [self.notes_prompt(search_query, chunk) for chunk in chunks]
+        return list(executor.map(in_current_context(lambda prompt: self._complete(self.notes_system_prompt, prompt, self.notes_tokens)), prompts))
+
+    def _reduce_notes(self, executor, search_query, notes, budget):
+        # Merge neighbouring notes in parallel until all of them fit in the budget of the final prompt
+        merge_budget = self._prompt_budget(self.merge_notes_prompt(search_query, []), self.notes_system_prompt, 2 * self.notes_tokens)
+        while len(notes) > 1:
+            counts = [len(tokens) + 1 for tokens in encode_all(self.tokenizer, notes)]
+            if sum(counts) <= budget:
+                break
+            batches, batch, batch_tokens = [], [], 0
+            for note, count in zip(notes, counts):
+                if batch and batch_tokens + count > merge_budget:
+                    batches.append(batch)
+                    batch, batch_tokens = [], 0
+                batch.append(note)
+                batch_tokens += count
+            batches.append(batch)
+            if len(batches) == len(notes):
+                # No two notes fit in one merge prompt, keep as much as fits instead
+                return pack_by_priority(self.tokenizer, notes, [0] * len(notes), budget)[0]
+            notes = list(executor.map(
+                in_current_context(lambda batch: self._complete(self.notes_system_prompt, self.merge_notes_prompt(search_query, batch), 2 * self.notes_tokens)),
+                batches))
+        return notes
+
+    def _write_sections(self, search_query, extracted, extracts, scores):
+        # Write the title and every section concurrently from one selection of the content, shared by every prompt
+        prompts = [self.write_section_prompt(search_query, title, description) for title, description, _ in self.report_sections]
+        longest = max(range(len(prompts)), key=lambda index: len(prompts[index]))
+        extract = self._select_context(prompts[longest], search_query, extracted, extracts, scores,
+                                       max(tokens for _, _, tokens in self.report_sections))
+        content = "\n".join(extract)
+        summaries = list(dict.fromkeys(result.summary for result in extracted if result.summary))
+        title_prompt = self.title_prompt(search_query, "\n".join(summaries) or "\n".join(extract[:3]))
+
+        start = time.perf_counter()
+        section_seconds = {}
+        with ThreadPoolExecutor(max_workers=len(self.report_sections) + 1) as executor:
+            complete = in_current_context(self._complete)
+            title = executor.submit(complete, self.system_prompt, title_prompt, self.title_completion_tokens)
+            futures = {executor.submit(complete, self.system_prompt, prompt + "\n" + content, tokens): name
+                       for prompt, (name, _, tokens) in zip(prompts, self.report_sections)}
+            for future in as_completed(futures):
+                if not section_seconds:
+                    set_span_attribute('ttft_seconds', round(time.perf_counter() - start, 6))
+                    if self.on_first_token is not None:
+                        self.on_first_token()
+                section_seconds[futures[future]] = round(time.perf_counter() - start, 6)
+            texts = {name: self._strip_heading(name, future.result()) for future, name in futures.items()}
+            company_name = title.result().strip().strip('#*"').strip() or "Company"
+        set_span_attribute('section_seconds', section_seconds)
+
+        answer = join_sections(f"# {company_name}", [(name, texts[name]) for name, _, _ in self.report_sections])
         print("Final Summary:")
         print(answer)
+        return answer
+
+    def _write_report(self, search_query, extracted, extracts, scores):
+        if self.mode == 'sections':
+            return self._write_sections(search_query, extracted, extracts, scores)
+        if self.mode == 'map_reduce':
+            prompt = self.report_prompt(search_query, source="research notes taken from the company's websites")
+            budget = self._prompt_budget(prompt, self.system_prompt, self.completion_tokens)
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                notes = self._map_notes(executor, search_query, [extract for extract in extracts if extract])
+                extract = self._reduce_notes(executor, search_query, notes, budget)
+        else:
+            prompt = self.report_prompt(search_query)
+            extract = self._select_context(prompt, search_query, extracted, extracts, scores)
+
+        prompt = prompt + "\n" + "\n".join(extract)
+
+        if self.stream:
+            print("Final Summary:")
+            answer = self._complete_stream(self.system_prompt, prompt, self.completion_tokens)
+        else:
+            answer = self._complete(self.system_prompt, prompt, self.completion_tokens)
+            print("Final Summary:")
+            print(answer)
+        return answer
+
+    def generate_answer(self, state):
+        search_results = state.get("search_results", [])
+        search_query = get_search_query(state)
+        # Get the raw content of the search results, the tavily score decides which content is kept first
+        extracted = sorted([result for result in search_results if result.raw_content_key],
+                           key=lambda result: result.score or 0, reverse=True)
+        # The pages are read from the blob store only for the time the prompt is built. A run resumed long after
+        # its extraction may find a page evicted from the store, its search snippet stands in for it.
+        extracts = [self.blob_store.read_text(result.raw_content_key) if self.blob_store.exists(result.raw_content_key)
+                    else result.content or '' for result in extracted]
+        scores = [result.score or 0 for result in extracted]
+        if self.dedup:
+            extracts = self._deduplicate(extracts)
+
+        previous = self.report_store.load(search_query) if self.report_store is not None else None
+        answer, report_status = self._refresh(previous, search_query, extracted, extracts) if previous is not None else (None, 'new')
+        if answer is not None:
+            print("Final Summary:")
+            print(answer)
+        else:
+            answer = self._write_report(search_query, extracted, extracts, scores)
 
         # Extract company name from the response
         company_name_match = re.search(r"^# (.+)", answer, re.MULTILINE)
@@ -92,4 +440,5 @@ class GenerateFinalSummary:
 
         state['messages'].append(AIMessage(content=answer))
         state['company_name'] = company_name  # Save the company name in the state
+        state['report_status'] = report_status
         return state
@@ -1,35 +1,175 @@
-from tavily import TavilyClient
 from dotenv import load_dotenv
-import os
+from concurrent.futures import ThreadPoolExecutor
+from utils.blob_store import get_default_blob_store
+from utils.cache import get_default_cache, make_key
+from utils.clients import get_client
+from utils.concurrency import api_slot
+from utils.page_cleaner import clean_page
+from utils.report_store import content_hash
+from utils.retry import CircuitOpenError, RetryPolicy, is_transient
+from utils.state import get_search_query
+from utils.tracing import external_call, in_current_context, set_span_attribute
 import logging
+import time
 
 load_dotenv()
 
 class TavilyExtract:
     """
     The TavilyExtract class is responsible for extracting content from the search results.
-    It interacts with the TavilyClient to retrieve the raw content of the search results.
+    It interacts with the TavilyClient to retrieve the raw content of the search results, the pages go to the
+    blob store and the search results keep their key. Extracted pages are kept in the response cache per url.
+
+    top_k: Extract the top_k search results only, all of them by default.
+    batch_size, max_concurrency: The urls per extract call, and how many calls are in flight.
+    max_retries, backoff: The attempts of a batch failing on a transient error, and the first wait between them.
+    report_store: In refresh mode, reuse the pages of the last report whose search snippet did not change.
+    clean_pages, max_page_chars: Strip the boilerplate of every page as its batch arrives and cap its size,
+                                 see utils/page_cleaner.py.
+    refresh: Extract every url again instead of reading the cached pages.
     """
-    def __init__(self):
-        self.tavily_client = TavilyClient(api_key=os.environ.get("TAVILY_API_KEY"))
+    def __init__(self, cache=None, top_k=None, batch_size=5, max_concurrency=4, max_retries=3, backoff=1.0, blob_store=None,
+                 report_store=None, clean_pages=True, max_page_chars=60_000, refresh=False):
+        self.tavily_client = get_client('tavily')
+        self.cache = cache or get_default_cache()
+        self.blob_store = blob_store or get_default_blob_store()
+        self.report_store = report_store
+        self.top_k = top_k
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.retry_policy = RetryPolicy(max_attempts=max_retries, initial_backoff=backoff)
+        self.clean_pages = clean_pages
+        self.max_page_chars = max_page_chars
+        self.refresh = refresh
 
-    def extract(self, state):
-        search_results = state.get("search_results", [])
-        urls = [site.metadata['url'] for site in search_results][:5]
-        try:
-            response = self.tavily_client.extract(urls=urls)
+    def _extract(self, urls):
+        pages = {url: None if self.refresh else self.cache.get(make_key('tavily.extract', url=url)) for url in urls}
+        missing = [url for url, page in pages.items() if page is None]
+        failed_results = []
+        if missing:
+            with api_slot('tavily'), external_call('tavily.extract'):
+                response = self.tavily_client.extract(urls=missing)
+            for web_site in response['results']:
+                self.cache.set(make_key('tavily.extract', url=web_site['url']), web_site)
+                pages[web_site['url']] = web_site
+            failed_results = response.get('failed_results', [])
+        return {'results': [page for page in pages.values() if page is not None],
+                'failed_results': failed_results}
+
+    def _clean(self, response):
+        # Cleans the pages of a response, noting the bytes and tokens removed from each
+        results = []
+        for web_site in response['results']:
+            raw_content = web_site['raw_content'] or ''
+            cleaned, removed = clean_page(raw_content, max_chars=self.max_page_chars)
+            results.append(dict(web_site, raw_content=cleaned,
+                                removed_bytes=len(raw_content.encode()) - len(cleaned.encode()),
+                                # Estimated at 4 characters a token, what is thrown away is not worth tokenizing
+                                removed_tokens=sum(len(text) for text in removed) // 4))
+        return dict(response, results=results)
 
+    def _extract_batch(self, urls):
+        # Extract a batch of urls, retrying transient errors with exponential backoff. Returns the response
+        # (None if every attempt failed), the time spent and the last error.
+        start = time.perf_counter()
+        try:
+            response = self.retry_policy.call(self._extract, urls, name='tavily extraction')
         except Exception as e:
             logging.error("An error occurred during tavily extraction: %s", e)
+            return None, time.perf_counter() - start, e
+        if self.clean_pages:
+            response = self._clean(response)
+        return response, time.perf_counter() - start, None
+
+    def batches(self, urls):
+        # The top_k urls, in batches of batch_size
+        urls = urls[:self.top_k]
+        return [urls[i:i + self.batch_size] for i in range(0, len(urls), self.batch_size)]
+
+    def prefetch(self, batches, cancelled=None):
+        """
+        Extracts batches of urls into the cache ahead of the extract node (e.g. while the operator is still
+        deciding), without retries. Batches not sent yet are skipped once cancelled is set.
+        """
+        def prefetch_batch(batch):
+            if cancelled is not None and cancelled.is_set():
+                return
+            try:
+                self._extract(batch)
+            except Exception as e:
+                logging.error("An error occurred during a speculative tavily extraction: %s", e)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(batches)))) as executor:
+            list(executor.map(in_current_context(prefetch_batch), batches))
+
+    def _reuse_unchanged(self, search_results, previous):
+        # Points the results whose snippet is the same as for the last report at the page extracted then
+        reused = set()
+        for result in search_results[:self.top_k]:
+            page = previous['pages'].get(result.url)
+            if page and page['snippet'] == content_hash(result.content) and self.blob_store.exists(page['content']):
+                result.raw_content_key = page['content']
+                result.raw_content_bytes = self.blob_store.size(page['content'])
+                reused.add(result.url)
+        return reused
+
+    def extract(self, state):
+        search_results = state.get("search_results", [])
+        previous = self.report_store.load(get_search_query(state)) if self.report_store is not None else None
+        reused = self._reuse_unchanged(search_results, previous) if previous is not None else set()
+        if previous is not None:
+            set_span_attribute('reused_pages', len(reused))
+            print(f"♻️ {len(reused)} pages unchanged since the last report")
+        urls = [site.url for site in search_results][:self.top_k]
+        batches = self.batches([url for url in urls if url not in reused])
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(batches)))) as executor:
+            outcomes = list(executor.map(in_current_context(self._extract_batch), batches))
+
+        pages, timings, errors = {}, {}, {}
+        for batch, (response, seconds, error) in zip(batches, outcomes):
+            for url in batch:
+                timings[url] = seconds
+                errors[url] = str(error) if error else 'no content returned'
+            if response is None:
+                continue
+            for failed in response['failed_results']:
+                errors[failed['url']] = failed.get('error') or errors.get(failed['url'])
+            for web_site in response['results']:
+                pages[web_site['url']] = web_site
+
+        for result in search_results:
+            url = result.url
+            if url not in timings:
+                continue
+            result.extract_seconds = round(timings[url], 3)
+            # A page left empty by the cleaning (links only) has no content either
+            if url in pages and pages[url]['raw_content']:
+                raw_content = pages[url]['raw_content']
+                result.raw_content_key = self.blob_store.put(raw_content)
+                result.raw_content_bytes = len(raw_content.encode())
+                result.removed_bytes = pages[url].get('removed_bytes', 0)
+                result.removed_tokens = pages[url].get('removed_tokens', 0)
+            else:
+                result.extract_error = errors[url]
+
+        if self.clean_pages:
+            set_span_attribute('removed_bytes', sum(page['removed_bytes'] for page in pages.values()))
+            set_span_attribute('removed_tokens', sum(page['removed_tokens'] for page in pages.values()))
+
+        if not pages and not reused:
+            # Every batch failed: a transient error is raised for the node's retry policy, others end the run here
+            batch_errors = [error for _, _, error in outcomes if error is not None]
+            if batch_errors and all(is_transient(error) or isinstance(error, CircuitOpenError) for error in batch_errors):
+                raise batch_errors[-1]
             print("❗An error occurred during tavily extraction, Sorry for the inconvenience❗")
-            # If this happens, reset the search and bring the user back to the beginning of the workflow.
-            state['messages'].append('tavily_search')  
- 
+            # If nothing could be extracted, reset the search and bring the user back to the beginning of the workflow.
+            state['route'] = 'tavily_search'
             return state
-        
-        for web_site in response['results']:
-            for result in search_results:
-                if result.metadata['url'] == web_site['url']:
-                    result.metadata['raw_content'] = web_site['raw_content']
-        state['messages'].append('generate_final_summary')
+
+        failed = len(urls) - len([url for url in urls if url in pages or url in reused])
+        if failed:
+            logging.error("Tavily extraction failed for %s of %s urls", failed, len(urls))
+            print(f"❗ Could not extract {failed} of {len(urls)} pages, continuing with the rest ❗")
+        state['route'] = 'generate_final_summary'
         return state
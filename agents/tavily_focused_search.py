@@ -1,8 +1,10 @@
-from langchain.schema import Document
-from langchain_core.messages import HumanMessage
-from tavily import TavilyClient
 from dotenv import load_dotenv
-import os
+from utils.cache import get_default_cache, make_key, normalize_query
+from utils.clients import get_client
+from utils.concurrency import api_slot
+from utils.retry import CircuitOpenError, is_transient
+from utils.state import SearchResult, get_search_query
+from utils.tracing import external_call
 import re
 import logging
 
@@ -12,9 +14,19 @@ class TavilyFocusedSearch:
     '''
     The TavilyFocusedSearch class is responsible for conducting a focused search using the Tavily API.
     It interacts with the TavilyClient to retrieve search results based on user queries.
+    Responses are kept in the response cache, keyed on the query and the excluded domains. With refresh, the
+    search is sent again and its response replaces the cached one, a refresh needs the results as they are now.
+    A transient error (or Tavily being down) is raised for the node's retry policy, only an error caused by the
+    query sends the user back to the search.
     '''
-    def __init__(self):
-        self.tavily_client = TavilyClient(api_key=os.environ.get("TAVILY_API_KEY"))
+    def __init__(self, cache=None, refresh=False):
+        self.tavily_client = get_client('tavily')
+        self.cache = cache or get_default_cache()
+        self.refresh = refresh
+
+    def _search(self, search_query, exclude_domains):
+        with api_slot('tavily'), external_call('tavily.search'):
+            return self.tavily_client.search(search_query, search_depth="advanced", max_results=10, exclude_domains=exclude_domains)
 
     def parse_search_summary(self,relevant_company):
         '''
@@ -31,39 +43,45 @@ class TavilyFocusedSearch:
         combined_string = ".".join(cleaned_text.split('.')[:2])
         return combined_string
         
+    def focused_query(self, search_query, confirmed_summary):
+        return search_query + f". {self.parse_search_summary(confirmed_summary)}."
+
+    def cached_search(self, search_query, exclude_domains):
+        cache_key = make_key('tavily.search', query=normalize_query(search_query), search_depth="advanced",
+                             max_results=10, exclude_domains=exclude_domains)
+        return self.cache.get_or_set(cache_key, lambda: self._search(search_query, exclude_domains),
+                                     refresh=self.refresh)
+
     def search(self, state):
         search_results = state.get("search_results", [])
-        search_query = [message for message in state['messages'] if type(message) == HumanMessage][-1].content
+        search_query = get_search_query(state)
         # Get the list of domains to exclude from the search, human in the loop labeled the irrelevant results
         # thus we know the user is not interested in these results.
-        exclude_domains = [result.metadata['url'] for result in search_results if result.metadata['relevance'] == 'no']
+        exclude_domains = [result.url for result in search_results if result.relevance == 'no']
         # Get the summary of the relevant company, human in the loop confirmed this is the correct company
-        relevant_company = [result.metadata['summary'] for result in search_results if result.metadata['relevance'] == 'yes'][0]
-        # Clean the summary of the relevant company
-        relevant_company = self.parse_search_summary(relevant_company)
-        # Append the relevant company to the search query
-        search_query += f". {relevant_company}."
+        confirmed_summary = [result.summary for result in search_results if result.relevance == 'yes'][0]
+        # Append the cleaned summary of the relevant company to the search query
+        search_query = self.focused_query(search_query, confirmed_summary)
         try:
-            response = self.tavily_client.search(search_query, search_depth="advanced", max_results=10, exclude_domains=exclude_domains)
-            state['messages'].append('tavily_extract')
+            response = self.cached_search(search_query, exclude_domains)
+            state['route'] = 'tavily_extract'
             state['search_results'] = []
         except Exception as e:
             logging.error("An error occurred during tavily focused search: %s", e)
+            if is_transient(e) or isinstance(e, CircuitOpenError):
+                raise
             print("❗An error occurred during a focused search, Sorry for the inconvenience❗")
             # In some cases, the search query may cause an error from TavilySearch.
             # If this happens, reset the search and bring the user back to the beginning of the workflow.
-            state['messages'].append('tavily_search')
+            state['route'] = 'tavily_search'
             state['search_results'] = []
 
             return state
 
-        search_results = [
-                Document(page_content=result["content"], metadata={"url": result["url"],
-                                                                   "score": result["score"],
-                                                                   "relevance":'',
-                                                                   "summary":'',
-                                                                   "raw_content":''})
-                for result in response['results']]
+        # The confirmed summary is kept with the new results, the final summary ranks passages against it
+        search_results = [SearchResult(url=result["url"], content=result["content"], score=result["score"],
+                                       summary=confirmed_summary)
+                          for result in response['results']]
       
         state['search_results'] = search_results
 
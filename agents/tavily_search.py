@@ -1,8 +1,13 @@
-from langchain.schema import Document
-from tavily import TavilyClient
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, RemoveMessage
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-import os
+from utils.cache import get_default_cache, make_key, normalize_query
+from utils.clients import get_client
+from utils.concurrency import api_slot
+from utils.operator import get_operator
+from utils.retry import CircuitOpenError, RetryPolicy, is_transient
+from utils.state import SearchResult
+from utils.tracing import external_call, in_current_context, set_span_attribute
 import logging  
 
 load_dotenv()
@@ -12,43 +17,90 @@ class TavilySearch:
     """
     The TavilySearch class is responsible for conducting a search using the Tavily API.
     It interacts with the TavilyClient to retrieve search results based on user queries.
+    Responses are kept in the response cache, so repeating a query does not call the Tavily API again.
+    A search failing on a transient error is retried with the retry_policy (the node itself is not retried,
+    it would ask the user for the company again). When it still fails, or Tavily is down, the run stops to be
+    resumed later, other errors ask the user for a new query.
+
+    With expand_query, a few variants of the query are searched concurrently instead: the query itself, the
+    exact name in quotes, the name followed by "company" and, when the operator has one (e.g. the description
+    of a batch company), the name followed by an industry hint. The results are merged by url and ranked by
+    reciprocal rank fusion (the sum of 1 / (rrf_k + rank) over the variants that found a url), so urls found
+    by several variants come first, and the max_results best are kept. The wider set of companies found makes
+    it more likely the right one is among the groups the user reviews, without another reset.
     """
-    def __init__(self):
-        self.tavily_client = TavilyClient(api_key=os.environ.get("TAVILY_API_KEY"))
+    def __init__(self, cache=None, expand_query=False, max_results=15, rrf_k=60, retry_policy=None):
+        self.tavily_client = get_client('tavily')
+        self.cache = cache or get_default_cache()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.expand_query = expand_query
+        self.max_results = max_results
+        self.rrf_k = rrf_k
+
+    def _search(self, search_query):
+        with api_slot('tavily'), external_call('tavily.search'):
+            return self.tavily_client.search(
+                search_query,
+                search_depth="advanced",
+                max_results=10  
+            )
+
+    def _cached_search(self, search_query):
+        cache_key = make_key('tavily.search', query=normalize_query(search_query), search_depth="advanced", max_results=10)
+        return self.cache.get_or_set(cache_key, lambda: self.retry_policy.call(self._search, search_query))
 
-    def get_user_query(self):
-        print("\n             🔍 COMPANY RESEARCHER 🔍")
-        print("           POWERED BY TAVILY and LANGCHAIN")
-        print("======================================================")
-        user_query = input("\nPlease let us know what company you'd like to research: ")
+    @staticmethod
+    def query_variants(search_query, hint=None):
+        """
+        The queries searched for a query with expand_query, the query itself first.
+        """
+        name = search_query.strip().strip('"')
+        variants = [search_query, f'"{name}"']
+        if 'company' not in name.lower():
+            variants.append(f"{name} company")
+        if hint:
+            variants.append(f"{name} {hint}")
+        return list(dict.fromkeys(variants))
+
+    def _expanded_search(self, search_query, hint):
+        # Search every variant concurrently, the variants that failed are left out unless all of them did
+        variants = self.query_variants(search_query, hint)
+        with ThreadPoolExecutor(max_workers=len(variants)) as executor:
+            futures = [executor.submit(in_current_context(self._cached_search), variant) for variant in variants]
+        rankings, error = [], None
+        for variant, future in zip(variants, futures):
+            try:
+                rankings.append(future.result()['results'])
+            except Exception as e:
+                logging.error("An error occurred during the search for the query variant '%s': %s", variant, e)
+                error = e
+        if not rankings:
+            raise error
+        set_span_attribute('query_variants', len(variants))
+        return reciprocal_rank_fusion(rankings, self.rrf_k)[:self.max_results]
 
-        return user_query
+    def get_user_query(self, operator):
+        return operator.ask_company()
 
-    def search(self, state):
+    def search(self, state, config=None):
+        operator = get_operator(config)
         search_results = []
-        user_query = self.get_user_query()
+        user_query = self.get_user_query(operator)
 
-        # Update the state with the user query
-        state['messages'] = [HumanMessage(content=user_query)]
+        # Update the state with the user query, the messages of the previous search are removed
+        state['messages'] = [RemoveMessage(id=message.id) for message in state.get('messages', [])] + [HumanMessage(content=user_query)]
         while True:
             try:
                 # Get the latest human message as the search query AKA the user query
                 search_query = [message for message in state['messages'] if type(message) == HumanMessage][-1].content
                 # Perform the search
-                response = self.tavily_client.search(
-                    search_query,
-                    search_depth="advanced",
-                    max_results=10  
-                )
+                if self.expand_query:
+                    results = self._expanded_search(search_query, operator.search_hint())
+                else:
+                    results = self._cached_search(search_query)['results']
                 search_results.extend([
-                    Document(page_content=result["content"], metadata={
-                        "url": result["url"],
-                        "score": result["score"],
-                        "relevance": '',
-                        "summary": '',
-                        "raw_content": ''
-                    })
-                    for result in response['results']
+                    SearchResult(url=result["url"], content=result["content"], score=result["score"])
+                    for result in results
                 ])
 
                 state['search_results'] = search_results
@@ -56,7 +108,25 @@ class TavilySearch:
 
             except Exception as e:
                 logging.error("An error occurred during the search: %s", e)
-                new_query = input("\n❗ Please try again, provide more detail on the company and avoid using abbreviations\n"
-                                  "Query length may be too short. Min query length is 5 characters. ❗\n"
-                                  "\nPlease let us know what company you'd like to research: ")
+                if is_transient(e) or isinstance(e, CircuitOpenError):
+                    print("❗ Tavily is not responding, please try again later (resume with the thread id) ❗")
+                    raise
+                new_query = operator.ask_retry_query()
                 state['messages'].append(HumanMessage(content=new_query))
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Merges ranked lists of search results by url. A url scores the sum of 1 / (k + rank) over the lists it is in
+    (rank starting at 1), its score is replaced by that and its content is taken from the list ranking it best.
+    Returns the merged results by descending score.
+    """
+    fused, best_rank = {}, {}
+    for ranking in rankings:
+        for rank, result in enumerate(ranking, start=1):
+            url = result["url"]
+            if url not in fused or rank < best_rank[url]:
+                best_rank[url] = rank
+                fused[url] = dict(result, score=fused[url]["score"] if url in fused else 0.0)
+            fused[url]["score"] += 1 / (k + rank)
+    return sorted(fused.values(), key=lambda result: result["score"], reverse=True)
@@ -0,0 +1,215 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from company_researcher import CompanyResearcher, DEFAULT_RETRY_POLICIES
+from utils.clients import set_rate_limit
+from utils.checkpoints import delete_thread
+from utils.concurrency import set_api_limit
+from utils.operator import BatchOperator
+from utils.render_pool import check_formats
+from utils.retry import RetryPolicy
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+import uuid
+
+
+class BatchResearcher:
+    """
+    The BatchResearcher researches a list of companies headless, without anyone at the keyboard.
+
+    Every company is a separate invocation of the CompanyResearcher graph driven by a BatchOperator, which
+    uses the optional hints (a known domain or a one line description) to pick the matching search result
+    group. Invocations run concurrently on a worker pool, while the number of requests in flight to each
+    API is capped separately so a large batch does not flood Tavily or OpenAI.
+
+    One line per company is appended to a JSONL manifest as soon as the company is done:
+        company, domain, description: the input row
+        status: 'ok' or 'failed'
+        company_name, report_path: the title of the report and where it was written
+        error: why the research failed
+        report_status: 'new', or with refresh 'updated' or 'unchanged'
+        seconds: wall time spent on the company
+        thread_id: the checkpoint thread of the run, a failed company is resumed from its last completed
+                   node by researching it again with this thread id (see --retry-failed). The checkpoints
+                   of a company researched successfully are deleted, unless keep_checkpoints.
+
+    Reports are rendered in the background process pool, a company is written to the manifest once its
+    report is rendered so the worker can start on the next company right away.
+    """
+    def __init__(self, save_dir='pdfs', workers=4, tavily_concurrency=4, openai_concurrency=4, summary_mode='single',
+                 report_formats=('pdf',), trace_path=None, passage_ranking='bm25', refresh=False,
+                 regenerate=False, expand_query=False, merge_similar_groups=False, retry_policies=None,
+                 keep_checkpoints=False):
+        self.workers = workers
+        set_api_limit('tavily', tavily_concurrency)
+        set_api_limit('openai', openai_concurrency)
+        self.researcher = CompanyResearcher(save_dir=save_dir, summary_mode=summary_mode,
+                                            report_formats=report_formats, background_render=True,
+                                            trace_path=trace_path, passage_ranking=passage_ranking,
+                                            # Streams of concurrent companies would interleave, and the batch
+                                            # operator answers at once so there is no think time to speculate in
+                                            stream_summary=False, speculative=False, refresh=refresh,
+                                            regenerate=regenerate, expand_query=expand_query,
+                                            merge_similar_groups=merge_similar_groups,
+                                            retry_policies=retry_policies)
+        self.keep_checkpoints = keep_checkpoints
+
+    def research(self, company):
+        operator = BatchOperator(company['company'], company.get('domain'), company.get('description'))
+        entry = dict(company, status='ok', company_name=None, report_path=None, report_status=None, error=None)
+        entry['thread_id'] = company.get('thread_id') or uuid.uuid4().hex
+        start = time.perf_counter()
+        try:
+            final_state = self.researcher.run(operator=operator, thread_id=entry['thread_id'])
+            entry['company_name'] = final_state.get('company_name')
+            entry['report_path'] = final_state.get('report_path')
+            entry['report_status'] = final_state.get('report_status')
+            if not self.keep_checkpoints:
+                # Nothing resumes a finished run, its checkpoints (and the report in them) would only pile up
+                delete_thread(self.researcher.checkpointer, entry['thread_id'])
+        except Exception as e:
+            logging.error("An error occurred while researching %s: %s", company['company'], e)
+            entry['status'] = 'failed'
+            entry['error'] = str(e)
+        entry['seconds'] = round(time.perf_counter() - start, 3)
+        return entry
+
+    def _write_entry(self, manifest, entry):
+        manifest.write(json.dumps(entry) + "\n")
+        manifest.flush()
+        status = '✅' if entry['status'] == 'ok' else '❗'
+        print(f"{status} {entry['company']} ({entry['seconds']}s) {entry['report_path'] or entry['error']}")
+
+    def _write_rendered(self, manifest, renders, jobs):
+        # Writes the entries of the reports rendered (or failed to), renders maps the render jobs to their entry
+        for job in jobs:
+            entry = renders.pop(job)
+            if job.exception() is not None:
+                entry['status'] = 'failed'
+                entry['error'] = f"Rendering failed: {job.exception()}"
+            self._write_entry(manifest, entry)
+
+    def run(self, companies, manifest_path):
+        convert_to_pdf = self.researcher.convert_to_pdf
+        renders = {}
+        # The manifest is only written from this thread, as the researches and their renders finish
+        with ThreadPoolExecutor(max_workers=self.workers) as executor, open(manifest_path, 'a') as manifest:
+            futures = [executor.submit(self.research, company) for company in companies]
+            for future in as_completed(futures):
+                entry = future.result()
+                job = convert_to_pdf.jobs.pop(entry['report_path'], None)
+                if job is None:
+                    self._write_entry(manifest, entry)
+                else:
+                    renders[job] = entry
+                self._write_rendered(manifest, renders, [job for job in renders if job.done()])
+            # Wait for the last reports to render before closing the manifest
+            self._write_rendered(manifest, renders, as_completed(list(renders)))
+        stats = self.researcher.llm_cache_stats()
+        print(f"🗃️ LLM cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)")
+
+
+def load_companies(path):
+    """
+    Reads the companies to research from a CSV (with a header) or a JSONL file.
+    Each row needs a 'company' and can have a 'domain' and a 'description' hint.
+    """
+    with open(path, newline='') as f:
+        if path.endswith('.jsonl'):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+    companies = []
+    for row in rows:
+        if not (row.get('company') or '').strip():
+            continue
+        companies.append({'company': row['company'].strip(),
+                          'domain': (row.get('domain') or '').strip() or None,
+                          'description': (row.get('description') or '').strip() or None})
+    return companies
+
+
+def failed_companies(manifest_path):
+    """
+    Reads the companies whose latest manifest entry failed, with the thread id of their run so the
+    research continues from its last checkpoint instead of starting over.
+    """
+    latest = {}
+    with open(manifest_path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                latest[(entry['company'], entry.get('domain'))] = entry
+    return [{'company': entry['company'],
+             'domain': entry.get('domain'),
+             'description': entry.get('description'),
+             'thread_id': entry.get('thread_id')}
+            for entry in latest.values() if entry['status'] == 'failed']
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Research a list of companies without interactive input.")
+    parser.add_argument("companies", nargs="?", help="CSV or JSONL file with a 'company' column and optional 'domain'/'description' hints")
+    parser.add_argument("--save-dir", default="pdfs", help="Directory the reports are written to")
+    parser.add_argument("--manifest", default=None, help="JSONL results manifest (defaults to <save-dir>/manifest.jsonl)")
+    parser.add_argument("--workers", type=int, default=4, help="Number of companies researched concurrently")
+    parser.add_argument("--tavily-concurrency", type=int, default=4, help="Max concurrent Tavily requests")
+    parser.add_argument("--openai-concurrency", type=int, default=4, help="Max concurrent OpenAI requests")
+    parser.add_argument("--tavily-rpm", type=float, default=None, help="Tavily requests per minute limit")
+    parser.add_argument("--openai-rpm", type=float, default=None, help="OpenAI requests per minute limit")
+    parser.add_argument("--openai-tpm", type=float, default=None, help="OpenAI tokens per minute limit")
+    parser.add_argument("--summary-mode", choices=["single", "map_reduce", "sections"], default="single",
+                        help="map_reduce condenses every extracted page into notes before writing the report, "
+                             "sections writes every report section concurrently")
+    parser.add_argument("--passage-ranking", choices=["bm25", "embedding", "none"], default="bm25",
+                        help="How passages are ranked for the single mode prompt, none keeps whole pages by search score")
+    parser.add_argument("--formats", default="pdf",
+                        help="Comma separated report formats to write: pdf, html and/or md")
+    parser.add_argument("--trace", default=None, help="Append per node tracing spans to this JSONL file")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Update the last report of each company, re-extracting changed pages and rewriting affected sections only")
+    parser.add_argument("--regenerate", action="store_true",
+                        help="Generate the summaries and reports again instead of using cached completions")
+    parser.add_argument("--expand-query", action="store_true",
+                        help="Search a few variants of each company name (with its description as industry hint) and merge the results")
+    parser.add_argument("--merge-similar-groups", action="store_true",
+                        help="Merge the search result groups of different domains with near identical content before summarizing them")
+    parser.add_argument("--node-attempts", type=int, default=None,
+                        help="Attempts of a graph node failing on a transient error (default 3), 1 to not retry")
+    parser.add_argument("--keep-checkpoints", action="store_true",
+                        help="Keep the checkpoints of the companies researched successfully")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Resume the companies that failed in the manifest instead of reading a companies file")
+    args = parser.parse_args()
+    if not args.companies and not args.retry_failed:
+        parser.error("a companies file is required unless --retry-failed is given")
+    try:
+        report_formats = check_formats([report_format.strip() for report_format in args.formats.split(',')])
+    except ValueError as e:
+        parser.error(str(e))
+    manifest_path = args.manifest or os.path.join(args.save_dir, 'manifest.jsonl')
+    # Requests over every worker share the per provider limits, unset flags keep the environment defaults
+    if args.tavily_rpm:
+        set_rate_limit('tavily', args.tavily_rpm)
+    if args.openai_rpm or args.openai_tpm:
+        set_rate_limit('openai', args.openai_rpm, args.openai_tpm)
+
+    batch = BatchResearcher(save_dir=args.save_dir,
+                            workers=args.workers,
+                            tavily_concurrency=args.tavily_concurrency,
+                            openai_concurrency=args.openai_concurrency,
+                            summary_mode=args.summary_mode,
+                            report_formats=report_formats,
+                            trace_path=args.trace,
+                            passage_ranking=None if args.passage_ranking == "none" else args.passage_ranking,
+                            refresh=args.refresh,
+                            regenerate=args.regenerate,
+                            expand_query=args.expand_query,
+                            merge_similar_groups=args.merge_similar_groups,
+                            retry_policies={node: RetryPolicy(max_attempts=args.node_attempts) for node in DEFAULT_RETRY_POLICIES}
+                                           if args.node_attempts else None,
+                            keep_checkpoints=args.keep_checkpoints)
+    companies = failed_companies(manifest_path) if args.retry_failed else load_companies(args.companies)
+    batch.run(companies, manifest_path)
@@ -0,0 +1,164 @@
+from types import SimpleNamespace
+import hashlib
+import random
+import re
+import time
+
+# Words the fake pages and completions are made of, so the tokenizer sees realistic text
+WORDS = ("the company develops software platform customers market products revenue research team global "
+         "solutions data services industry enterprise growth partners technology cloud analytics founded "
+         "headquarters employees funding investors product launch competitors pricing").split()
+
+
+def seeded_random(*parts):
+    # Deterministic random generator per call, so runs are repeatable
+    return random.Random(hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest())
+
+
+def fake_text(rng, chars):
+    words = []
+    size = 0
+    while size < chars:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    sentences = [" ".join(words[i:i + 12]).capitalize() + "." for i in range(0, len(words), 12)]
+    return "\n\n".join(" ".join(sentences[i:i + 5]) for i in range(0, len(sentences), 5))
+
+
+def fake_page(rng, chars):
+    """
+    A page of about chars characters of text between the boilerplate of a real page: a navigation menu, a
+    cookie banner, buttons and a footer of links.
+    """
+    links = " ".join(f"[{word.capitalize()}](https://example.com/{word})" for word in rng.sample(WORDS, 8))
+    return (f"Skip to main content\n\n{links}\n\nMenu\n\n{fake_text(rng, chars)}\n\n"
+            f"We use cookies to improve your experience. Accept all\n\nShare   Tweet\n\n{links}\n\n"
+            f"© 2024 All rights reserved. Privacy Policy | Terms of Use")
+
+
+class FakeTavilyClient:
+    """
+    Stand-in for TavilyClient. Search returns results spread over a few companies' domains (with subdomains,
+    so the url grouping has work to do) and extract returns pages of raw_content_chars characters of text
+    with boilerplate around it.
+    Every call sleeps for latency seconds.
+    """
+    def __init__(self, api_key=None, latency=0.2, results=10, content_chars=400, raw_content_chars=50_000, companies=4):
+        self.latency = latency
+        self.results = results
+        self.content_chars = content_chars
+        self.raw_content_chars = raw_content_chars
+        self.companies = companies
+        self.calls = 0
+
+    def search(self, query, search_depth="basic", max_results=5, exclude_domains=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        rng = seeded_random('search', query)
+        # The company name (first words of the query) decides the domains, the focused search finds the same sites
+        slug = re.sub(r"[^a-z0-9]+", "", "".join(query.lower().split()[:3])) or "company"
+        exclude_domains = exclude_domains or []
+        results = []
+        for i in range(min(max_results, self.results)):
+            company = i % self.companies
+            name = f"{slug}{['labs', 'group', 'systems', 'studio', 'works', 'partners'][company % 6]}"
+            host = [f"www.{name}.com", f"blog.{name}.com", f"{name}.co.uk"][i % 3]
+            url = f"https://{host}/page{i}"
+            if url in exclude_domains:
+                continue
+            results.append({"url": url,
+                            "content": fake_text(rng, self.content_chars),
+                            "score": round(1 - i / (2 * self.results), 4)})
+        return {"query": query, "results": results}
+
+    def extract(self, urls, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return {"results": [{"url": url, "raw_content": fake_page(seeded_random('extract', url), self.raw_content_chars)} for url in urls],
+                "failed_results": []}
+
+
+class FakeCompletions:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, model, messages, max_tokens=None, stream=False, **kwargs):
+        self.client.calls += 1
+        prompt = messages[-1]['content']
+        rng = seeded_random('openai', prompt)
+        completion_tokens = min(max_tokens or self.client.completion_tokens, self.client.completion_tokens)
+        if "markdown documnet title" in prompt:
+            content = (f"# Fake Company {rng.randint(0, 99)}\n\n## Company Summary\n{fake_text(rng, completion_tokens)}\n\n"
+                       f"## Key Products\n- {fake_text(rng, completion_tokens // 2)}\n\n## Market\n{fake_text(rng, completion_tokens // 2)}")
+        else:
+            content = f"Company Name: Fake Company {rng.randint(0, 99)}: {fake_text(rng, completion_tokens * 2)}"
+        usage = SimpleNamespace(prompt_tokens=len(prompt) // 4, completion_tokens=len(content) // 4,
+                                total_tokens=(len(prompt) + len(content)) // 4)
+        if stream:
+            return self._stream(content, usage)
+        time.sleep(self.client.latency + completion_tokens * self.client.seconds_per_token)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason="stop")],
+                               usage=usage)
+
+
+    def _stream(self, content, usage):
+        # The first chunk arrives after latency seconds, every following token after seconds_per_token
+        time.sleep(self.client.latency)
+        for token in re.findall(r"\S+\s*|\s+", content):
+            time.sleep(self.client.seconds_per_token)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token), finish_reason=None)],
+                                  usage=None)
+        yield SimpleNamespace(choices=[], usage=usage)
+
+
+class FakeOpenAI:
+    """
+    Stand-in for the OpenAI client, chat.completions.create answers after latency seconds plus
+    seconds_per_token for each completion token it returns. With stream=True the tokens are yielded as
+    chunks, followed by a chunk with the usage.
+    """
+    def __init__(self, api_key=None, latency=1.0, seconds_per_token=0.0, completion_tokens=400):
+        self.latency = latency
+        self.seconds_per_token = seconds_per_token
+        self.completion_tokens = completion_tokens
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=FakeCompletions(self))
+
+
+class FakeTokenizer:
+    """
+    Regex tokenizer used when the tiktoken BPE files cannot be downloaded, roughly one token per word.
+    """
+    pattern = re.compile(r"\w+|[^\w\s]+|\s+")
+
+    def encode(self, text, **kwargs):
+        return self.pattern.findall(text)
+
+    def encode_batch(self, texts, **kwargs):
+        return [self.encode(text) for text in texts]
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+class ScriptedOperator:
+    """
+    Answers the human in the loop questions from a script: the company, then one answer per
+    summary shown ('no' rejects a group, 'yes' accepts it), then 'no' to searching another company.
+    """
+    def __init__(self, company, confirm_answers=('no', 'yes')):
+        self.company = company
+        self.confirm_answers = list(confirm_answers)
+
+    def ask_company(self):
+        return self.company
+
+    def ask_retry_query(self):
+        return self.company
+
+    def confirm_company(self, summary, urls):
+        return self.confirm_answers.pop(0) if self.confirm_answers else 'yes'
+
+    def ask_search_another(self, report_path=None):
+        return 'no'
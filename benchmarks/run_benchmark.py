@@ -0,0 +1,158 @@
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import os
+import resource
+import tempfile
+import time
+
+from benchmarks.fakes import FakeOpenAI, FakeTavilyClient, FakeTokenizer, ScriptedOperator, seeded_random, fake_page, fake_text
+
+
+def install_fakes(args, workdir):
+    """
+    Registers the offline fakes as the Tavily and OpenAI clients of every agent and points the response cache
+    and the blob store at empty directories, so every run pays for the (fake) API calls. The real tiktoken tokenizer is used
+    when its BPE files are available, the FakeTokenizer otherwise.
+    """
+    os.environ.setdefault("TAVILY_API_KEY", "offline")
+    os.environ.setdefault("OPENAI_API_KEY", "offline")
+    os.environ["COMPANY_RESEARCHER_CACHE"] = os.path.join(workdir, "cache.sqlite")
+    os.environ["COMPANY_RESEARCHER_BLOBS"] = os.path.join(workdir, "blobs")
+
+    from utils.clients import register_client, set_rate_limit
+
+    # The fakes are built through the client registry, so they share its rate limiters like the real clients
+    register_client('tavily', lambda: FakeTavilyClient(latency=args.tavily_latency, results=args.results,
+                                                       raw_content_chars=args.page_chars, companies=args.groups))
+    register_client('openai', lambda: FakeOpenAI(latency=args.openai_latency, seconds_per_token=args.openai_seconds_per_token,
+                                                 completion_tokens=args.completion_tokens))
+    set_rate_limit('tavily', args.tavily_rpm)
+    set_rate_limit('openai', args.openai_rpm, args.openai_tpm)
+
+    from utils.token_budget import get_tokenizer
+    try:
+        return get_tokenizer("gpt-3.5-turbo"), "tiktoken"
+    except Exception:
+        import tiktoken
+        tiktoken.encoding_for_model = lambda model: FakeTokenizer()
+        return get_tokenizer("gpt-3.5-turbo"), "fake (tiktoken BPE unavailable offline)"
+
+
+def cpu_seconds(fn, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return (time.process_time() - start) / repeat
+
+
+def micro_benchmarks(args, tokenizer, workdir):
+    from utils.page_cleaner import clean_page
+    from utils.render_pool import render_report
+    from utils.token_budget import pack_by_priority
+    from utils.url_parser import group_urls
+
+    client = FakeTavilyClient(latency=0, results=args.group_urls, companies=max(1, args.group_urls // 5))
+    urls = [result["url"] for result in client.search("grouping benchmark", max_results=args.group_urls)["results"]]
+    pages = [fake_text(seeded_random("page", i), args.page_chars) for i in range(args.results)]
+    raw_pages = [fake_page(seeded_random("page", i), args.page_chars) for i in range(args.results)]
+    report = f"# Benchmark Company\n\n## Company Summary\n{pages[0][:4000]}\n\n## Key Products\n- {pages[1][:2000]}\n\n## Market\n{pages[2][:2000]}"
+    output_base = os.path.join(workdir, "micro_report")
+
+    return {
+        "group_urls_ms": 1000 * cpu_seconds(lambda: group_urls(urls), 20),
+        "page_cleaning_cpu_s": cpu_seconds(lambda: [clean_page(page) for page in raw_pages], 3),
+        "token_packing_cpu_s": cpu_seconds(lambda: pack_by_priority(tokenizer, pages, list(range(len(pages))), 12000), 3),
+        "pdf_render_cpu_s": cpu_seconds(lambda: render_report(report, output_base, ("pdf",)), 3),
+    }
+
+
+def end_to_end(args, workdir):
+    from company_researcher import CompanyResearcher
+    from utils.checkpoints import open_checkpointer
+    from utils.tracing import summarize
+
+    trace_path = os.path.join(workdir, "trace.jsonl")
+    researcher = CompanyResearcher(save_dir=os.path.join(workdir, "pdfs"), summary_mode=args.summary_mode,
+                                   trace_path=trace_path, stream_summary=args.stream,
+                                   checkpointer=open_checkpointer(os.path.join(workdir, "checkpoints.sqlite")))
+
+    def research(i):
+        # Reject the first group, then accept the next one, like an operator disambiguating a name
+        return researcher.run(operator=ScriptedOperator(f"Benchmark Company {i}", confirm_answers=args.script))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        list(executor.map(research, range(args.companies)))
+    research_seconds = time.perf_counter() - start
+    researcher.convert_to_pdf.drain()
+    total_seconds = time.perf_counter() - start
+
+    return {
+        "companies": args.companies,
+        "research_seconds": research_seconds,
+        "total_seconds": total_seconds,
+        "companies_per_minute": 60 * args.companies / total_seconds,
+        "stages": summarize([trace_path]),
+    }
+
+
+def peak_memory_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return {"self_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "render_workers_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024}
+
+
+def print_results(results):
+    print(f"\nTokenizer: {results['tokenizer']}")
+    micro = results["micro"]
+    print(f"group_urls ({results['args']['group_urls']} urls): {micro['group_urls_ms']:.2f} ms")
+    print(f"page cleaning ({results['args']['results']} pages): {micro['page_cleaning_cpu_s']:.3f} s CPU")
+    print(f"token packing ({results['args']['results']} pages of {results['args']['page_chars']} chars): {micro['token_packing_cpu_s']:.3f} s CPU")
+    print(f"pdf render: {micro['pdf_render_cpu_s']:.3f} s CPU")
+
+    e2e = results["end_to_end"]
+    print(f"\n{e2e['companies']} companies in {e2e['total_seconds']:.2f} s "
+          f"({e2e['companies_per_minute']:.1f} companies/min, research done after {e2e['research_seconds']:.2f} s)")
+    print(f"{'stage':<24}{'runs':>6}{'p50 s':>10}{'p95 s':>10}{'ext p50 s':>12}{'ttft p50 s':>12}")
+    for node, stats in e2e["stages"].items():
+        print(f"{node:<24}{stats['runs']:>6}{stats['active_p50']:>10.3f}{stats['active_p95']:>10.3f}{stats['external_p50']:>12.3f}"
+              f"{stats['ttft_p50']:>12.3f}")
+    memory = results["peak_memory"]
+    print(f"\npeak memory: {memory['self_mb']:.1f} MB (render workers {memory['render_workers_mb']:.1f} MB)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline CompanyResearcher benchmark with fake Tavily and OpenAI clients.")
+    parser.add_argument("--companies", type=int, default=8, help="Companies researched end to end")
+    parser.add_argument("--workers", type=int, default=4, help="Companies researched concurrently")
+    parser.add_argument("--summary-mode", choices=["single", "map_reduce", "sections"], default="single")
+    parser.add_argument("--script", default="no,yes", help="Scripted answers to the company summaries")
+    parser.add_argument("--tavily-latency", type=float, default=0.2, help="Seconds per fake Tavily call")
+    parser.add_argument("--openai-latency", type=float, default=0.5, help="Seconds per fake OpenAI call")
+    parser.add_argument("--openai-seconds-per-token", type=float, default=0.0, help="Extra seconds per completion token")
+    parser.add_argument("--tavily-rpm", type=float, default=None, help="Tavily requests per minute limit")
+    parser.add_argument("--openai-rpm", type=float, default=None, help="OpenAI requests per minute limit")
+    parser.add_argument("--openai-tpm", type=float, default=None, help="OpenAI tokens per minute limit")
+    parser.add_argument("--stream", action="store_true", help="Stream the final summary and record time to first token")
+    parser.add_argument("--completion-tokens", type=int, default=400, help="Size of the fake completions")
+    parser.add_argument("--results", type=int, default=10, help="Results per fake search")
+    parser.add_argument("--groups", type=int, default=4, help="Companies (domain groups) per fake search")
+    parser.add_argument("--page-chars", type=int, default=50_000, help="Size of each extracted page")
+    parser.add_argument("--group-urls", type=int, default=300, help="Urls in the group_urls micro benchmark")
+    parser.add_argument("--json", default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args()
+    args.script = args.script.split(",")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        tokenizer, tokenizer_name = install_fakes(args, workdir)
+        results = {"args": vars(args),
+                   "tokenizer": tokenizer_name,
+                   "micro": micro_benchmarks(args, tokenizer, workdir),
+                   "end_to_end": end_to_end(args, workdir)}
+        results["peak_memory"] = peak_memory_mb()
+
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Modules that must not be imported before the first research runs
+DEFERRED_MODULES = ("openai", "tavily", "tiktoken", "IPython", "xhtml2pdf", "markdown2", "langchain", "sentence_transformers")
+
+# Runs in a fresh interpreter, so every measurement pays for the imports like a new process does
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import company_researcher
+imported = time.perf_counter()
+from utils.checkpoints import open_checkpointer
+checkpointer = open_checkpointer(sys.argv[1])
+company_researcher.CompanyResearcher(checkpointer=checkpointer)
+constructed = time.perf_counter()
+company_researcher.CompanyResearcher(checkpointer=checkpointer)
+second = time.perf_counter()
+print(json.dumps({"import_s": imported - start, "construct_s": constructed - imported, "second_construct_s": second - constructed,
+                  "loaded": [name for name in sys.argv[2:] if name in sys.modules]}))
+"""
+
+
+def probe(workdir, deferred_modules):
+    env = dict(os.environ, TAVILY_API_KEY=os.environ.get("TAVILY_API_KEY", "offline"),
+               OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "offline"),
+               COMPANY_RESEARCHER_CACHE=os.path.join(workdir, "cache.sqlite"))
+    output = subprocess.run([sys.executable, "-c", PROBE, os.path.join(workdir, "checkpoints.sqlite"), *deferred_modules],
+                            check=True, capture_output=True, text=True, env=env).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time importing company_researcher and building a CompanyResearcher in fresh processes.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes measured")
+    parser.add_argument("--max-import-seconds", type=float, default=None, help="Fail if the median import is slower")
+    parser.add_argument("--max-construct-seconds", type=float, default=None, help="Fail if the median construction is slower")
+    parser.add_argument("--json", default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        probe(workdir, DEFERRED_MODULES)  # Warm the OS file cache and the .pyc files
+        runs = [probe(workdir, DEFERRED_MODULES) for _ in range(args.runs)]
+
+    results = {stat: statistics.median(run[stat] for run in runs) for stat in ("import_s", "construct_s", "second_construct_s")}
+    results["loaded"] = sorted({name for run in runs for name in run["loaded"]})
+
+    print(f"import company_researcher: {results['import_s']:.3f} s (median of {args.runs})")
+    print(f"first CompanyResearcher:   {results['construct_s']:.3f} s")
+    print(f"next CompanyResearcher:    {results['second_construct_s']:.3f} s")
+    print(f"deferred modules loaded at startup: {', '.join(results['loaded']) or 'none'}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failures = []
+    if results["loaded"]:
+        failures.append(f"{', '.join(results['loaded'])} imported at startup")
+    if args.max_import_seconds is not None and results["import_s"] > args.max_import_seconds:
+        failures.append(f"import took {results['import_s']:.3f} s (max {args.max_import_seconds} s)")
+    if args.max_construct_seconds is not None and results["construct_s"] > args.max_construct_seconds:
+        failures.append(f"construction took {results['construct_s']:.3f} s (max {args.max_construct_seconds} s)")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,21 @@ from agents.tavily_focused_search import TavilyFocusedSearch
 from agents.generate_final_summary import GenerateFinalSummary
 from agents.tavily_extract import TavilyExtract
 from agents.analyze_search import AnalyzeSearch
+from agents.focus_speculator import FocusSpeculator
+from utils.checkpoints import get_default_checkpointer
+from utils.render_pool import check_formats
+from utils.report_store import ReportStore
+from utils.retry import RetryPolicy
 from utils.state import State
 from agents.convert_to_pdf import ConvertToPDF
+from utils.tracing import Tracer
+import argparse
+import copy
+import inspect
 import logging
-from IPython.display import Image
+import os
+import threading
+import uuid
 
 # Configure errorlogging
 logging.basicConfig(
@@ -16,6 +27,13 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'  
 )
 
+# Nodes retried when they fail on a transient error. The nodes asking the user (the search, the analysis and
+# the report) are not: running them again would ask again and lose the answers. Their Tavily and OpenAI calls
+# are retried on their own instead (see TavilySearch and RateLimited). The extraction retries each batch of
+# urls (see TavilyExtract). A call is only ever retried by one of these layers, see retried_by_caller.
+DEFAULT_RETRY_POLICIES = {'tavily_focused_search': RetryPolicy(),
+                          'generate_final_summary': RetryPolicy()}
+
 class CompanyResearcher:
     """
     The goal of company reasearcher is to automate the process of company research , 
@@ -46,105 +64,263 @@ class CompanyResearcher:
     edges to determine the flow based on the results of each task. The graph is compiled and executed
     to automate the company research process, providing a structured and efficient approach to gathering
     and summarizing information.
+
+    Every run is checkpointed under its thread id (SQLite by default, see utils/checkpoints.py), running again
+    with the thread id of a failed or interrupted run continues it from its last completed node. The agents are
+    built the first time their node runs and the graph is compiled once per process (see get_graph).
+
+    trace_path: Append a tracing span per node run to this JSONL file (COMPANY_RESEARCHER_TRACE by default).
+    speculative: Start the focused search and extraction of a company while the user reads its summary.
+    refresh: Bring the last report of a company up to date instead of writing a new one, see
+             utils/report_store.py. The focused search and the pages are fetched again, not read from the cache.
+    regenerate: Generate the summaries and the report again instead of using cached completions.
+    expand_query: Search a few variants of the first query and fuse their results (see TavilySearch).
+    merge_similar_groups: Offer the result groups of different domains with near identical content as one.
+    retry_policies: The RetryPolicy of each node (None to not retry it), over DEFAULT_RETRY_POLICIES.
     """
-    def __init__(self):
-       # Initialize agents
-        self.tavily_search = TavilySearch()
-        self.analyze_search = AnalyzeSearch()
-        self.tavily_focused_search = TavilyFocusedSearch()
-        self.tavily_extract = TavilyExtract()
-        self.generate_final_summary = GenerateFinalSummary()
-        self.convert_to_pdf = ConvertToPDF()  
-
-        # Define the LangGraph Graph
-        self.workflow = StateGraph(State)
-        self.workflow.add_node("tavily_search", self.tavily_search.search) 
-        self.workflow.add_node("analyze_search", self.analyze_search.analyze_search)
-        self.workflow.add_node("tavily_focused_search", self.tavily_focused_search.search)  
-        self.workflow.add_node("tavily_extract", self.tavily_extract.extract)
-        self.workflow.add_node("generate_final_summary", self.generate_final_summary.generate_answer)
-        self.workflow.add_node("convert_to_pdf", self.convert_to_pdf.convert)  
-
-        # Define the conditional edges
-        self.workflow.add_conditional_edges("analyze_search",
-                                            self.analyze_search_condition,
-                                            {"tavily_focused_search": "tavily_focused_search",
-                                            "tavily_search": "tavily_search"})
-        self.workflow.add_conditional_edges("tavily_focused_search",
-                                            self.tavily_focused_search_condition,
-                                            {"tavily_extract": "tavily_extract",
-                                            "tavily_search": "tavily_search"})
-        self.workflow.add_conditional_edges("tavily_extract",
-                                            self.tavily_extract_condition,
-                                            {"generate_final_summary": "generate_final_summary",
-                                             "tavily_search": "tavily_search"})
-        self.workflow.add_conditional_edges("convert_to_pdf",
-                                            self.convert_to_pdf_condition,
-                                            {"end": END,
-                                            "tavily_search": "tavily_search"})
-        # Define the entry point
-        self.workflow.set_entry_point("tavily_search")
-        # Add edges to the graph
-        self.workflow.add_edge("tavily_search", "analyze_search")
-        self.workflow.add_edge("generate_final_summary", "convert_to_pdf") 
-        self.workflow.add_edge("convert_to_pdf", END) 
-
-        # Compile the graph
-        self.company_researcher = self.workflow.compile()
+    def __init__(self, save_dir='pdfs', summary_mode='single', report_formats=('pdf',), background_render=True,
+                 trace_path=None, passage_ranking='bm25', stream_summary=True, checkpointer=None,
+                 speculative=True, max_speculative_calls=6, refresh=False, regenerate=False,
+                 expand_query=False, merge_similar_groups=False, retry_policies=None):
+        self.save_dir = save_dir
+        self.summary_mode = summary_mode
+        # Checked now, the agent rendering them is only built once the report is written
+        self.report_formats = check_formats(report_formats)
+        self.background_render = background_render
+        self.passage_ranking = passage_ranking
+        self.stream_summary = stream_summary
+        self.speculative = speculative
+        self.max_speculative_calls = max_speculative_calls
+        self.regenerate = regenerate
+        self.expand_query = expand_query
+        self.merge_similar_groups = merge_similar_groups
+        self.retry_policies = dict(DEFAULT_RETRY_POLICIES, **(retry_policies or {}))
+        # What a refresh needs from the last report of each company is kept next to the reports
+        self.report_store = ReportStore(save_dir) if refresh else None
+        # The agents are built the first time their node runs, see _agent
+        self._agents = {}
+        self._agents_lock = threading.RLock()
+
+        trace_path = trace_path or os.environ.get("COMPANY_RESEARCHER_TRACE")
+        # Compile the graph, saving the state after every node
+        self.checkpointer = checkpointer or get_default_checkpointer()
+        self.company_researcher = get_graph(self.checkpointer, trace_path)
+
+    ##### The agents, built on first use #####
+
+    def _agent(self, name, build):
+        # Building an agent creates its API client, so researchers that never reach a node do not pay for it.
+        # Reentrant since building analyze_search builds the agents its speculator runs.
+        with self._agents_lock:
+            if name not in self._agents:
+                self._agents[name] = build()
+            return self._agents[name]
+
+    @property
+    def tavily_search(self):
+        return self._agent('tavily_search', lambda: TavilySearch(expand_query=self.expand_query))
+
+    @property
+    def tavily_focused_search(self):
+        return self._agent('tavily_focused_search', lambda: TavilyFocusedSearch(refresh=self.report_store is not None))
+
+    @property
+    def tavily_extract(self):
+        return self._agent('tavily_extract', lambda: TavilyExtract(report_store=self.report_store,
+                                                                   refresh=self.report_store is not None))
+
+    @property
+    def analyze_search(self):
+        # The focused search and extraction start while the user is still reading a company summary
+        def build():
+            speculative = self.speculative and self.report_store is None
+            speculator = FocusSpeculator(self.tavily_focused_search, self.tavily_extract,
+                                         self.max_speculative_calls) if speculative else None
+            return AnalyzeSearch(merge_similar_groups=self.merge_similar_groups, speculator=speculator,
+                                 regenerate=self.regenerate)
+        return self._agent('analyze_search', build)
+
+    @property
+    def convert_to_pdf(self):
+        return self._agent('convert_to_pdf', lambda: ConvertToPDF(save_dir=self.save_dir, formats=self.report_formats,
+                                                                  background=self.background_render,
+                                                                  report_store=self.report_store))
+
+    @property
+    def generate_final_summary(self):
+        # While the report streams in, a render worker is started so the PDF starts as soon as it is done
+        return self._agent('generate_final_summary',
+                           lambda: GenerateFinalSummary(mode=self.summary_mode, passage_ranking=self.passage_ranking,
+                                                        stream=self.stream_summary, report_store=self.report_store,
+                                                        regenerate=self.regenerate,
+                                                        on_first_token=lambda: self.convert_to_pdf.warm_up()))
+
+    def llm_cache_stats(self):
+        """
+        Hits, misses and hit rate of the LLM cache over the agents built so far.
+        """
+        with self._agents_lock:
+            caches = [agent.llm_cache for agent in self._agents.values() if hasattr(agent, 'llm_cache')]
+        hits = sum(cache.stats()['hits'] for cache in caches)
+        misses = sum(cache.stats()['misses'] for cache in caches)
+        return {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses) if hits + misses else 0.0}
 
     ##### Define the functions that determine the conditional edges #####
     
     # Analyize the search results and determine if we should do a focused search or not
-    def analyze_search_condition(self,state):
-        messages = state["messages"]
-        last_message = messages[-1]
-        if last_message.content == "tavily_focused_search":
+    @staticmethod
+    def analyze_search_condition(state):
+        if state["route"] == "tavily_focused_search":
             return "tavily_focused_search"
         else:
             return "tavily_search"
 
     # Determine if we should extract or continue the search
-    def tavily_focused_search_condition(self,state):
-
-        messages = state["messages"]
-        last_message = messages[-1]
-
-        if last_message.content == "tavily_extract":
+    @staticmethod
+    def tavily_focused_search_condition(state):
+        if state["route"] == "tavily_extract":
             return "tavily_extract"
         else:
             return "tavily_search"
 
     # Determine if we should generate the final summary or continue the search
-    def tavily_extract_condition(self,state):
-        messages = state["messages"]
-        last_message = messages[-1]
-        if last_message.content == "tavily_search":
+    @staticmethod
+    def tavily_extract_condition(state):
+        if state["route"] == "tavily_search":
             return "tavily_search"
         else:
             return "generate_final_summary"
     
     # Determine if we should convert to pdf or continue the search
-    def convert_to_pdf_condition(self,state):
-        messages = state["messages"]
-        last_message = messages[-1]
-        if last_message.content == "end":
+    @staticmethod
+    def convert_to_pdf_condition(state):
+        if state["route"] == "end":
             return "end"
         else:
             return "tavily_search"
 
-    # Run the graph
-    def run(self):
+    # Run the graph, the operator answers the human in the loop questions (defaults to the console).
+    # A thread that did not reach the end yet is resumed from its last checkpoint.
+    def run(self, operator=None, thread_id=None):
+        config = {"recursion_limit": 50,
+                  "configurable": {"operator": operator,
+                                   "researcher": self,
+                                   "run_id": uuid.uuid4().hex,
+                                   "thread_id": thread_id or uuid.uuid4().hex}}
+        pending_nodes = self.company_researcher.get_state(config).next
+        if pending_nodes:
+            print(f"🔁 Resuming the research at {', '.join(pending_nodes)}")
+            return self.company_researcher.invoke(None, config=config)
         return self.company_researcher.invoke({"messages":[], 
                                         "search_results": [],
                                         "llm_answers": []},
-                                        config={"recursion_limit": 50})
+                                        config=config)
     
     # Generate a diagram of the graph
     def generate_graph_diagram(self):
+        from IPython.display import Image
         im = Image(self.company_researcher.get_graph(xray=True).draw_mermaid_png())
         open('company_researcher_diagram.png', 'wb').write(im.data)
 
+
+def _agent_node(agent, method):
+    # The node calls the agent of the researcher running the graph (passed in the run config), so one compiled
+    # graph serves every researcher in the process and an agent is only built when its node first runs
+    def node(state, config):
+        researcher = config["configurable"]["researcher"]
+        action = getattr(getattr(researcher, agent), method)
+        if 'config' in inspect.signature(action).parameters:
+            run = lambda state: action(state, config)
+        else:
+            run = action
+        policy = researcher.retry_policies.get(agent)
+        if policy is None:
+            return run(state)
+        # Every attempt starts from the state the node was given, not from what a failed attempt left of it
+        return policy.call(lambda: run(copy.deepcopy(state)), name=agent)
+    return node
+
+
+def build_graph(checkpointer, tracer=None):
+    """
+    Defines and compiles the research graph, every node wrapped in a tracing span when a tracer is given.
+    """
+    workflow = StateGraph(State)
+
+    # Add a node to the graph, wrapped in a tracing span when tracing is enabled
+    def add_node(name, action):
+        if tracer is not None:
+            action = tracer.wrap_node(name, action)
+        workflow.add_node(name, action)
+
+    # Define the LangGraph Graph
+    add_node("tavily_search", _agent_node("tavily_search", "search"))
+    add_node("analyze_search", _agent_node("analyze_search", "analyze_search"))
+    add_node("tavily_focused_search", _agent_node("tavily_focused_search", "search"))
+    add_node("tavily_extract", _agent_node("tavily_extract", "extract"))
+    add_node("generate_final_summary", _agent_node("generate_final_summary", "generate_answer"))
+    add_node("convert_to_pdf", _agent_node("convert_to_pdf", "convert"))
+
+    # Define the conditional edges
+    workflow.add_conditional_edges("analyze_search",
+                                   CompanyResearcher.analyze_search_condition,
+                                   {"tavily_focused_search": "tavily_focused_search",
+                                    "tavily_search": "tavily_search"})
+    workflow.add_conditional_edges("tavily_focused_search",
+                                   CompanyResearcher.tavily_focused_search_condition,
+                                   {"tavily_extract": "tavily_extract",
+                                    "tavily_search": "tavily_search"})
+    workflow.add_conditional_edges("tavily_extract",
+                                   CompanyResearcher.tavily_extract_condition,
+                                   {"generate_final_summary": "generate_final_summary",
+                                    "tavily_search": "tavily_search"})
+    workflow.add_conditional_edges("convert_to_pdf",
+                                   CompanyResearcher.convert_to_pdf_condition,
+                                   {"end": END,
+                                    "tavily_search": "tavily_search"})
+    # Define the entry point
+    workflow.set_entry_point("tavily_search")
+    # Add edges to the graph
+    workflow.add_edge("tavily_search", "analyze_search")
+    workflow.add_edge("generate_final_summary", "convert_to_pdf")
+    workflow.add_edge("convert_to_pdf", END)
+    return workflow.compile(checkpointer=checkpointer)
+
+
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+
+def get_graph(checkpointer, trace_path=None):
+    """
+    Returns the compiled graph for a checkpointer and trace file, it is only compiled once per process.
+    """
+    key = (id(checkpointer), trace_path)
+    with _graphs_lock:
+        if key not in _graphs:
+            # The checkpointer is kept with its graph so its id is not reused
+            _graphs[key] = (checkpointer, build_graph(checkpointer, Tracer(trace_path) if trace_path else None))
+        return _graphs[key][1]
+
 if __name__ == "__main__":
-    response = CompanyResearcher().run()
+    parser = argparse.ArgumentParser(description="Research a company with a human in the loop.")
+    parser.add_argument("--thread-id", default=None, help="Resume (or start) the run saved under this thread id")
+    parser.add_argument("--refresh", action="store_true", help="Update the last report of a company instead of writing a new one")
+    parser.add_argument("--regenerate", action="store_true", help="Generate the summaries and the report again instead of using cached completions")
+    parser.add_argument("--expand-query", action="store_true", help="Search a few variants of the query concurrently and merge their results")
+    parser.add_argument("--merge-similar-groups", action="store_true",
+                        help="Merge the search result groups of different domains with near identical content before summarizing them")
+    args = parser.parse_args()
+
+    thread_id = args.thread_id or uuid.uuid4().hex
+    print(f"🧵 Thread id: {thread_id} (pass --thread-id {thread_id} to resume this run if it stops)")
+    researcher = CompanyResearcher(refresh=args.refresh, regenerate=args.regenerate, expand_query=args.expand_query,
+                                   merge_similar_groups=args.merge_similar_groups)
+    response = researcher.run(thread_id=thread_id)
+    # Wait for the reports still rendering in the background, a failed render leaves no file behind
+    researcher.convert_to_pdf.drain()
+    for path, job in researcher.convert_to_pdf.jobs.items():
+        if job.exception() is not None:
+            print(f"❗ Could not render {path}: {job.exception()}")
 
 
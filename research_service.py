@@ -0,0 +1,271 @@
+from aiohttp import web, WSMsgType
+from concurrent.futures import ThreadPoolExecutor
+from company_researcher import CompanyResearcher
+from utils.checkpoints import delete_thread
+from utils.clients import set_rate_limit
+from utils.concurrency import set_api_limit
+from utils.operator import ServiceOperator
+from utils.render_pool import check_formats
+import argparse
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+
+class Session:
+    """
+    One analyst's research: the thread of its graph run, the operator holding its answers and where it is at.
+        status: 'running' (a worker is advancing the graph), 'pending' (waiting for the decision),
+                'done' or 'failed'
+        reports: the reports written so far, a session can research several companies
+        finished_at: when the session ended ('done' or 'failed'), None before
+    """
+    def __init__(self, company):
+        self.id = uuid.uuid4().hex
+        self.company = company
+        self.operator = ServiceOperator(company)
+        self.status = 'running'
+        self.decision = None
+        self.company_name = None
+        self.reports = []
+        self.error = None
+        self.finished_at = None
+        self.listeners = set()
+
+    def to_dict(self):
+        return {'session_id': self.id, 'company': self.company, 'status': self.status, 'decision': self.decision,
+                'company_name': self.company_name, 'reports': self.reports, 'error': self.error}
+
+
+class ResearchService:
+    """
+    The ResearchService hosts many concurrent research sessions in one process and lets analysts drive them
+    over HTTP instead of a terminal.
+
+    Every session is a CompanyResearcher graph run (its own checkpoint thread) answered by a ServiceOperator.
+    When the graph needs a human decision (the right company among the search results, research another
+    company, a new query) the run is suspended at its checkpoint and the decision is published on the
+    session; no thread waits for the analyst. Answering the decision resumes the run on one of the workers,
+    so the workers are only busy while the graph is actually working.
+
+    HTTP API:
+        POST /sessions {"company": ...}           start researching a company
+        GET  /sessions                            every session
+        GET  /sessions/{id}                       status, pending decision and reports of a session
+        POST /sessions/{id}/decision {"answer"}   answer the pending decision
+        GET  /sessions/{id}/events                WebSocket, the session is sent again every time it changes
+        GET  /reports/{name}                      a rendered report, 202 while it is still rendering
+
+    Sessions are kept in memory, the graph state itself is in the checkpointer. The checkpoints of a session
+    are deleted when it ends, the session itself is forgotten session_ttl seconds later, or sooner when more
+    than max_finished_sessions have ended.
+    """
+    def __init__(self, save_dir='pdfs', workers=8, summary_mode='single', passage_ranking='bm25', report_formats=('pdf',),
+                 trace_path=None, checkpointer=None, expand_query=False, merge_similar_groups=False,
+                 session_ttl=24 * 60 * 60, max_finished_sessions=1000):
+        # Summaries are not streamed to the console, the analyst reads them from the decisions
+        self.researcher = CompanyResearcher(save_dir=save_dir, summary_mode=summary_mode, report_formats=report_formats,
+                                            background_render=True, trace_path=trace_path,
+                                            passage_ranking=passage_ranking, stream_summary=False,
+                                            checkpointer=checkpointer, expand_query=expand_query,
+                                            merge_similar_groups=merge_similar_groups)
+        self.save_dir = save_dir
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.sessions = {}
+        self.session_ttl = session_ttl
+        self.max_finished_sessions = max_finished_sessions
+
+    def _advance(self, session):
+        # Runs the graph on a worker until it ends or stops on a decision
+        final_state = self.researcher.run(operator=session.operator, thread_id=session.id)
+        return final_state, session.operator.pending
+
+    async def advance(self, session):
+        session.status, session.decision = 'running', None
+        self.publish(session)
+        try:
+            final_state, pending = await asyncio.get_running_loop().run_in_executor(self.executor, self._advance, session)
+        except Exception as e:
+            logging.error("An error occurred in research session %s: %s", session.id, e)
+            session.status, session.error = 'failed', str(e)
+        else:
+            session.company_name = final_state.get('company_name') or session.company_name
+            if pending is not None:
+                session.status, session.decision = 'pending', dict(pending[1])
+                report_path = session.decision.get('report_path')
+                if report_path:
+                    session.decision['report_url'] = self.report_url(report_path)
+                    self._add_report(session, report_path)
+            else:
+                session.status = 'done'
+                if final_state.get('report_path'):
+                    self._add_report(session, final_state['report_path'])
+        if session.status in ('done', 'failed'):
+            await self._finish(session)
+        self.publish(session)
+
+    async def _finish(self, session):
+        # The run will not be resumed, its checkpoints go and the sessions ended long ago are forgotten
+        session.finished_at = time.time()
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, delete_thread,
+                                                             self.researcher.checkpointer, session.id)
+        except Exception as e:
+            logging.error("Could not delete the checkpoints of research session %s: %s", session.id, e)
+        self._forget_finished()
+
+    def _forget_finished(self):
+        finished = sorted((session for session in self.sessions.values() if session.finished_at is not None),
+                          key=lambda session: session.finished_at)
+        expired = time.time() - self.session_ttl
+        for i, session in enumerate(finished):
+            if session.finished_at < expired or len(finished) - i > self.max_finished_sessions:
+                del self.sessions[session.id]
+
+    def _add_report(self, session, report_path):
+        report = {'path': report_path, 'url': self.report_url(report_path)}
+        if report not in session.reports:
+            session.reports.append(report)
+
+    def report_url(self, report_path):
+        return f"/reports/{os.path.basename(report_path)}"
+
+    def publish(self, session):
+        for queue in session.listeners:
+            queue.put_nowait(session.to_dict())
+
+    ##### HTTP handlers #####
+
+    def _session(self, request):
+        session = self.sessions.get(request.match_info['session_id'])
+        if session is None:
+            raise web.HTTPNotFound(text="Unknown session")
+        return session
+
+    async def create_session(self, request):
+        body = await request.json()
+        company = (body.get('company') or '').strip()
+        if not company:
+            raise web.HTTPBadRequest(text="'company' is required")
+        session = Session(company)
+        self.sessions[session.id] = session
+        asyncio.create_task(self.advance(session))
+        return web.json_response(session.to_dict(), status=201)
+
+    async def list_sessions(self, request):
+        return web.json_response([session.to_dict() for session in self.sessions.values()])
+
+    async def get_session(self, request):
+        return web.json_response(self._session(request).to_dict())
+
+    async def answer_decision(self, request):
+        session = self._session(request)
+        if session.status != 'pending':
+            raise web.HTTPConflict(text=f"No decision is pending, the session is {session.status}")
+        body = await request.json()
+        try:
+            session.operator.answer(body.get('answer'))
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        asyncio.create_task(self.advance(session))
+        return web.json_response({'session_id': session.id, 'status': 'running'}, status=202)
+
+    async def session_events(self, request):
+        session = self._session(request)
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        queue = asyncio.Queue()
+        session.listeners.add(queue)
+        queue.put_nowait(session.to_dict())
+        try:
+            receive = asyncio.ensure_future(websocket.receive())
+            while not websocket.closed:
+                update = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait([receive, update], return_when=asyncio.FIRST_COMPLETED)
+                if update in done:
+                    await websocket.send_json(update.result())
+                else:
+                    update.cancel()
+                if receive in done:
+                    if receive.result().type in (WSMsgType.CLOSE, WSMsgType.CLOSED, WSMsgType.ERROR):
+                        break
+                    receive = asyncio.ensure_future(websocket.receive())
+            receive.cancel()
+        finally:
+            session.listeners.discard(queue)
+            await websocket.close()
+        return websocket
+
+    async def get_report(self, request):
+        name = request.match_info['name']
+        path = os.path.join(self.save_dir, name)
+        if os.path.basename(name) != name:
+            raise web.HTTPNotFound(text="Unknown report")
+        # A failed render leaves no file, its job is what is left of the report
+        jobs = self.researcher.convert_to_pdf.jobs
+        job = jobs.get(path)
+        if job is not None and not job.done():
+            return web.json_response({'status': 'rendering'}, status=202, headers={'Retry-After': '1'})
+        # The render is over and its outcome is served now, the job is not needed anymore
+        jobs.pop(path, None)
+        if job is not None and job.exception() is not None:
+            raise web.HTTPInternalServerError(text=f"Rendering failed: {job.exception()}")
+        if not os.path.isfile(path):
+            raise web.HTTPNotFound(text="Unknown report")
+        return web.FileResponse(path)
+
+    def app(self):
+        app = web.Application()
+        app.add_routes([web.post('/sessions', self.create_session),
+                        web.get('/sessions', self.list_sessions),
+                        web.get('/sessions/{session_id}', self.get_session),
+                        web.post('/sessions/{session_id}/decision', self.answer_decision),
+                        web.get('/sessions/{session_id}/events', self.session_events),
+                        web.get('/reports/{name}', self.get_report)])
+        app.on_cleanup.append(self._shutdown)
+        return app
+
+    async def _shutdown(self, app):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve research sessions over HTTP, the decisions are answered through the API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--save-dir", default="pdfs", help="Directory the reports are written to")
+    parser.add_argument("--workers", type=int, default=8, help="Graph runs advanced concurrently, sessions waiting on a decision do not use one")
+    parser.add_argument("--tavily-concurrency", type=int, default=4, help="Max concurrent Tavily requests")
+    parser.add_argument("--openai-concurrency", type=int, default=4, help="Max concurrent OpenAI requests")
+    parser.add_argument("--tavily-rpm", type=float, default=None, help="Tavily requests per minute limit")
+    parser.add_argument("--openai-rpm", type=float, default=None, help="OpenAI requests per minute limit")
+    parser.add_argument("--openai-tpm", type=float, default=None, help="OpenAI tokens per minute limit")
+    parser.add_argument("--summary-mode", choices=["single", "map_reduce", "sections"], default="single",
+                        help="map_reduce condenses every extracted page into notes before writing the report, "
+                             "sections writes every report section concurrently")
+    parser.add_argument("--passage-ranking", choices=["bm25", "embedding", "none"], default="bm25",
+                        help="How passages are ranked for the single mode prompt, none keeps whole pages by search score")
+    parser.add_argument("--formats", default="pdf", help="Comma separated report formats to write: pdf, html and/or md")
+    parser.add_argument("--trace", default=None, help="Append per node tracing spans to this JSONL file")
+    parser.add_argument("--expand-query", action="store_true", help="Search a few variants of the query concurrently and merge their results")
+    parser.add_argument("--merge-similar-groups", action="store_true",
+                        help="Merge the search result groups of different domains with near identical content before summarizing them")
+    args = parser.parse_args()
+    try:
+        report_formats = check_formats([report_format.strip() for report_format in args.formats.split(',')])
+    except ValueError as e:
+        parser.error(str(e))
+    set_api_limit('tavily', args.tavily_concurrency)
+    set_api_limit('openai', args.openai_concurrency)
+    if args.tavily_rpm:
+        set_rate_limit('tavily', args.tavily_rpm)
+    if args.openai_rpm or args.openai_tpm:
+        set_rate_limit('openai', args.openai_rpm, args.openai_tpm)
+
+    service = ResearchService(save_dir=args.save_dir, workers=args.workers, summary_mode=args.summary_mode,
+                              passage_ranking=None if args.passage_ranking == "none" else args.passage_ranking,
+                              report_formats=report_formats, trace_path=args.trace,
+                              expand_query=args.expand_query, merge_similar_groups=args.merge_similar_groups)
+    web.run_app(service.app(), host=args.host, port=args.port)
@@ -0,0 +1,39 @@
+from utils.page_cleaner import clean_page
+
+ARTICLE = ("Acme was founded in 1990 and makes razors, blades and grooming products.\n"
+           "Acme runs a subscribe-and-save model for razors, shipping refills every month.\n"
+           "It sells in 40 countries through retailers and its own online store.")
+
+
+def test_nav_menu_of_single_line_breaks_is_dropped_and_the_article_kept():
+    menu = "\n".join(f"[Section {i}](https://acme.com/section-{i})" for i in range(40))
+    cleaned, removed = clean_page(f"{menu}\n{ARTICLE}")
+    assert cleaned == ARTICLE
+    assert len(removed) == 40
+
+
+def test_cookie_footer_of_single_line_breaks_is_dropped_and_the_article_kept():
+    footer = ("We use cookies to improve your experience. Accept all\n"
+              "© 2024 Acme Inc. All rights reserved. [Privacy Policy](https://acme.com/privacy)")
+    cleaned, removed = clean_page(f"{ARTICLE}\n{footer}")
+    assert cleaned == ARTICLE
+    assert removed == footer.splitlines()
+
+
+def test_blocks_separated_by_blank_lines():
+    page = (f"Skip to main content\n\n[Home](https://acme.com) [About](https://acme.com/about)\n\nMenu\n\n"
+            f"{ARTICLE}\n\nShare   Tweet\n\nSubscribe to our newsletter for weekly deals.")
+    cleaned, _ = clean_page(page)
+    assert cleaned == ARTICLE
+
+
+def test_page_with_prose_is_never_emptied():
+    page = "We use cookies to improve your experience, accept all of them to read on."
+    cleaned, removed = clean_page(page)
+    assert cleaned == page
+    assert removed == []
+
+
+def test_page_of_links_only_is_emptied():
+    cleaned, _ = clean_page("[Home](https://acme.com)\n[About](https://acme.com/about)")
+    assert cleaned == ''
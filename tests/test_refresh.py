@@ -0,0 +1,53 @@
+from agents.tavily_extract import TavilyExtract
+from agents.tavily_focused_search import TavilyFocusedSearch
+from langchain_core.messages import HumanMessage
+from utils.blob_store import BlobStore
+from utils.cache import ResponseCache
+from utils.clients import RateLimitedTavily, RateLimiter
+from utils.report_store import ReportStore
+from utils.state import SearchResult
+import pytest
+
+URL = "https://www.acme.com/about"
+
+
+class ChangingTavily:
+    # A site whose page (and so its search snippet) changes between the two runs
+    def __init__(self):
+        self.version = 1
+
+    def search(self, query, **kwargs):
+        return {'results': [{'url': URL, 'content': f"Acme makes rockets, version {self.version}", 'score': 0.9}]}
+
+    def extract(self, urls, **kwargs):
+        return {'results': [{'url': url, 'raw_content': f"Acme makes rockets, the page as of version {self.version}."}
+                            for url in urls],
+                'failed_results': []}
+
+
+def research(tavily, tmp_path, refresh):
+    # The focused search and the extraction of a run, the report it writes is recorded for the next refresh
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'))
+    blob_store = BlobStore(str(tmp_path / 'blobs'))
+    report_store = ReportStore(str(tmp_path)) if refresh else None
+    focused_search = TavilyFocusedSearch(cache=cache, refresh=refresh)
+    extract = TavilyExtract(cache=cache, blob_store=blob_store, report_store=report_store, refresh=refresh)
+    focused_search.tavily_client = extract.tavily_client = RateLimitedTavily(tavily, RateLimiter(), None)
+    response = focused_search.cached_search("Acme rockets", [])
+    state = {'messages': [HumanMessage(content="Acme rockets")],
+             'search_results': [SearchResult(url=result['url'], content=result['content'])
+                                for result in response['results']]}
+    extract.extract(state)
+    if report_store is not None:
+        report_store.save("Acme rockets", str(tmp_path / 'Acme.pdf'), "# Acme", state['search_results'])
+    return blob_store.read_text(state['search_results'][0].raw_content_key)
+
+
+@pytest.mark.parametrize('refresh', [True, False])
+def test_refresh_sees_a_page_changed_within_the_cache_ttl(tmp_path, monkeypatch, refresh):
+    monkeypatch.setenv('TAVILY_API_KEY', 'test')
+    tavily = ChangingTavily()
+    assert "version 1" in research(tavily, tmp_path, refresh)
+    tavily.version = 2
+    # Without refresh the cached page is still served, a refresh must not reuse it
+    assert f"version {2 if refresh else 1}" in research(tavily, tmp_path, refresh)
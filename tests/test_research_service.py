@@ -0,0 +1,67 @@
+from aiohttp.test_utils import TestClient, TestServer
+from concurrent.futures import Future
+from langgraph.checkpoint.memory import MemorySaver
+from research_service import ResearchService, Session
+import asyncio
+import os
+
+
+def get_report(service, name):
+    async def get():
+        async with TestClient(TestServer(service.app())) as client:
+            response = await client.get(f'/reports/{name}')
+            return response.status, await response.text()
+    return asyncio.run(get())
+
+
+def test_failed_render_is_reported_once(tmp_path):
+    service = ResearchService(save_dir=str(tmp_path), checkpointer=MemorySaver())
+    job = Future()
+    job.set_exception(RuntimeError("xhtml2pdf could not render"))
+    jobs = service.researcher.convert_to_pdf.jobs
+    jobs[os.path.join(str(tmp_path), 'Acme.pdf')] = job
+    status, text = get_report(service, 'Acme.pdf')
+    assert status == 500
+    assert "xhtml2pdf could not render" in text
+    assert jobs == {}
+    assert get_report(service, 'Acme.pdf')[0] == 404
+
+
+def test_rendering_and_rendered_reports(tmp_path):
+    service = ResearchService(save_dir=str(tmp_path), checkpointer=MemorySaver())
+    path = os.path.join(str(tmp_path), 'Acme.pdf')
+    job = Future()
+    service.researcher.convert_to_pdf.jobs[path] = job
+    assert get_report(service, 'Acme.pdf')[0] == 202
+    with open(path, 'w') as f:
+        f.write('%PDF')
+    job.set_result({'pdf': path})
+    assert get_report(service, 'Acme.pdf') == (200, '%PDF')
+    assert get_report(service, '..%2FAcme.pdf')[0] == 404
+
+
+def test_finished_sessions_are_cleaned_up(tmp_path, monkeypatch):
+    deleted = []
+    monkeypatch.setattr('research_service.delete_thread', lambda checkpointer, thread_id: deleted.append(thread_id))
+    service = ResearchService(save_dir=str(tmp_path), checkpointer=MemorySaver(), max_finished_sessions=2)
+
+    def advance(session):
+        if session.company == 'Broken':
+            raise RuntimeError("boom")
+        return {'company_name': session.company}, None
+    service._advance = advance
+
+    async def research(companies):
+        sessions = [Session(company) for company in companies]
+        for session in sessions:
+            service.sessions[session.id] = session
+            await service.advance(session)
+        return sessions
+    sessions = asyncio.run(research(['Acme', 'Broken', 'Initech']))
+    assert [session.status for session in sessions] == ['done', 'failed', 'done']
+    assert deleted == [session.id for session in sessions]
+    # Past max_finished_sessions the sessions that ended first are forgotten
+    assert list(service.sessions) == [session.id for session in sessions[1:]]
+    service.session_ttl = 0
+    service._forget_finished()
+    assert service.sessions == {}
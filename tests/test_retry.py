@@ -0,0 +1,161 @@
+from agents.tavily_extract import TavilyExtract
+from tavily.errors import BadRequestError, UsageLimitExceededError
+from utils.blob_store import BlobStore
+from utils.cache import ResponseCache
+from utils.clients import RateLimited, RateLimitedTavily, RateLimiter
+from utils.retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+from utils.state import SearchResult
+import pytest
+import time
+
+
+def open_breaker(threshold=2, reset_seconds=0.05):
+    breaker = CircuitBreaker('test', failure_threshold=threshold, reset_seconds=reset_seconds)
+    for _ in range(threshold):
+        breaker.before_call()
+        breaker.record_failure(TimeoutError("timed out"))
+    return breaker
+
+
+def client(breaker, fn):
+    # A wrapper calling fn through the breaker, rate limit retries without waiting
+    return RateLimited(fn, RateLimiter(), breaker, max_retries=2, backoff=0)
+
+
+def test_opens_after_threshold_and_fails_fast():
+    breaker = open_breaker()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_permanent_errors_do_not_open():
+    breaker = CircuitBreaker('test', failure_threshold=1)
+    breaker.before_call()
+    breaker.record_failure(BadRequestError("bad query"))
+    breaker.before_call()
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    breaker.before_call()
+    assert breaker.opened_at is None
+
+
+def test_failed_trial_reopens():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_failure(TimeoutError("timed out"))
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_abandoned_trial_lets_the_next_call_decide():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.abandon()
+    breaker.before_call()
+
+
+def test_rate_limited_trial_is_retried_without_tripping():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    responses = iter([UsageLimitExceededError("slow down"), "ok"])
+
+    def fn():
+        response = next(responses)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert client(breaker, fn)._call(fn, (), {}) == "ok"
+    assert breaker.opened_at is None
+    assert client(breaker, fn)._call(lambda: "again", (), {}) == "again"
+
+
+def test_trial_out_of_rate_limit_retries_reopens_instead_of_sticking():
+    breaker = open_breaker()
+    time.sleep(0.06)
+
+    def fn():
+        raise UsageLimitExceededError("slow down")
+
+    with pytest.raises(UsageLimitExceededError):
+        client(breaker, fn)._call(fn, (), {})
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    time.sleep(0.06)
+    breaker.before_call()
+
+
+def test_transient_errors_are_retried_by_the_client():
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) < 3:
+            raise TimeoutError("timed out")
+        return "ok"
+
+    assert client(None, fn)._call(fn, (), {}) == "ok"
+    assert len(calls) == 3
+
+
+def test_transient_retries_are_bounded_and_permanent_errors_are_not_retried():
+    calls = []
+
+    def fn(error):
+        calls.append(1)
+        raise error
+
+    with pytest.raises(TimeoutError):
+        client(None, fn)._call(fn, (TimeoutError("timed out"),), {})
+    assert len(calls) == 3
+    calls.clear()
+    with pytest.raises(BadRequestError):
+        client(None, fn)._call(fn, (BadRequestError("bad query"),), {})
+    assert len(calls) == 1
+
+
+def test_nested_policies_and_client_retry_once():
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise TimeoutError("timed out")
+
+    inner = RetryPolicy(max_attempts=3, initial_backoff=0)
+    outer = RetryPolicy(max_attempts=3, initial_backoff=0)
+    with pytest.raises(TimeoutError):
+        outer.call(lambda: inner.call(lambda: client(None, fn)._call(fn, (), {})))
+    assert len(calls) == 3
+
+
+class TimingOutTavily:
+    def __init__(self):
+        self.calls = 0
+
+    def extract(self, urls, **kwargs):
+        self.calls += 1
+        raise TimeoutError("timed out")
+
+
+@pytest.mark.parametrize('node_policy', [None, RetryPolicy(max_attempts=3, initial_backoff=0)])
+def test_extraction_attempts_are_bounded(tmp_path, monkeypatch, node_policy):
+    monkeypatch.setenv('TAVILY_API_KEY', 'test')
+    tavily = TimingOutTavily()
+    extract = TavilyExtract(cache=ResponseCache(str(tmp_path / 'cache.sqlite')),
+                            blob_store=BlobStore(str(tmp_path / 'blobs')), batch_size=5, max_retries=3, backoff=0)
+    extract.tavily_client = RateLimitedTavily(tavily, RateLimiter(), None, backoff=0)
+    state = {'search_results': [SearchResult(url=f"https://acme.com/{i}", content="Acme") for i in range(10)]}
+    run = extract.extract if node_policy is None else lambda state: node_policy.call(extract.extract, state)
+    with pytest.raises(TimeoutError):
+        run(state)
+    # 3 attempts for each of the 2 batches, whoever retries them
+    assert tavily.calls == 6
@@ -0,0 +1,23 @@
+from utils.state import SearchResult
+from utils.url_parser import group_search_results, group_urls
+
+
+def test_ip_hosts_and_digit_names_are_not_grouped_together():
+    groups = group_urls(["http://10.0.0.1/a", "http://192.168.1.1/", "http://10.0.0.1/b", "https://123.com/",
+                         "https://456.com/", "https://acme1.com/", "https://acme.co.uk/"])
+    assert groups == {'10.0.0.1': ["http://10.0.0.1/a", "http://10.0.0.1/b"],
+                      '192.168.1.1': ["http://192.168.1.1/"],
+                      '123': ["https://123.com/"],
+                      '456': ["https://456.com/"],
+                      'Acme1': ["https://acme1.com/", "https://acme.co.uk/"]}
+
+
+def test_groups_without_content_are_not_merged():
+    text = "Acme makes reusable rockets and launches satellites for commercial customers"
+    results = [SearchResult(url="https://acme.com/", content=text),
+               SearchResult(url="https://acme-rockets.net/", content=text),
+               SearchResult(url="https://initech.com/", content=""),
+               SearchResult(url="https://globex.com/", content="")]
+    groups = group_search_results(results, merge_similar=True)
+    assert sorted(sorted(result.url for result in group) for group in groups) == [
+        ["https://acme-rockets.net/", "https://acme.com/"], ["https://globex.com/"], ["https://initech.com/"]]
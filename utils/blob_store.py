@@ -0,0 +1,123 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+# Location of the shared blob store, override with the COMPANY_RESEARCHER_BLOBS environment variable
+DEFAULT_BLOB_PATH = os.path.join('.cache', 'blobs')
+
+
+class BlobStore:
+    """
+    The BlobStore keeps large texts (the raw content of extracted pages) on disk, content addressed: a text is
+    stored once under the sha256 of its bytes, so the graph state only holds the key and the same page
+    extracted by several sessions shares one file.
+
+    A text is read whole, only for the time it is used (see GenerateFinalSummary). Files are written to a
+    temporary name and renamed, so a reader never sees a partial blob.
+
+    The store is bounded to max_bytes, the least recently used blobs (stored or read last) are removed first.
+    Blobs used in the last min_age seconds are kept whatever the size, the running sessions still read them.
+    """
+    def __init__(self, path=DEFAULT_BLOB_PATH, max_bytes=1024 * 1024 * 1024, min_age=60 * 60):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self._size = None  # Bytes stored, counted on the first new blob
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def put(self, text):
+        """
+        Stores a text and returns its key, None for an empty text.
+        """
+        if not text:
+            return None
+        data = text.encode()
+        key = hashlib.sha256(data).hexdigest()
+        path = self._file(key)
+        if not self._touch(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._added(len(data))
+        return key
+
+    def read_text(self, key):
+        # The text of a blob, '' for the None key of an empty text
+        if key is None:
+            return ''
+        path = self._file(key)
+        with open(path, 'rb') as f:
+            text = f.read().decode()
+        self._touch(path)
+        return text
+
+    def exists(self, key):
+        return key is not None and os.path.exists(self._file(key))
+
+    def size(self, key):
+        return os.path.getsize(self._file(key)) if key is not None else 0
+
+    def _touch(self, path):
+        # Marks a blob as used, False if it is not stored (or was just removed)
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _blobs(self):
+        # (last use, path, size) of every stored blob, the temporary files being written are skipped
+        for directory in os.scandir(self.path):
+            if directory.is_dir():
+                for entry in os.scandir(directory.path):
+                    if len(entry.name) == 64:
+                        stat = entry.stat()
+                        yield stat.st_mtime, entry.path, stat.st_size
+
+    def _added(self, size):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, _, size in self._blobs())
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._size = self._evict()
+
+    def _evict(self):
+        # Remove the least recently used blobs until the store fits in max_bytes, returns the bytes left.
+        # The files are listed again, other processes may share the store.
+        blobs = sorted(self._blobs())
+        total = sum(size for _, _, size in blobs)
+        recent = time.time() - self.min_age
+        for used, path, size in blobs:
+            if total <= self.max_bytes or used > recent:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_blob_store():
+    """
+    Returns the blob store shared by every agent in the process.
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = BlobStore(os.environ.get('COMPANY_RESEARCHER_BLOBS', DEFAULT_BLOB_PATH))
+        return _default_store
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Location of the shared cache, override with the COMPANY_RESEARCHER_CACHE environment variable
+DEFAULT_CACHE_PATH = os.path.join('.cache', 'company_researcher.sqlite')
+
+
+def normalize_query(query):
+    """
+    Normalizes a search query so that queries differing only in case or whitespace share a cache entry.
+    """
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+def make_key(namespace, **params):
+    """
+    Builds a cache key from a namespace (e.g. 'tavily.search') and the parameters of the call.
+    Lists are treated as sets since their order does not change the response (e.g. exclude_domains).
+    """
+    normalized = {name: sorted(value) if isinstance(value, (list, tuple, set)) else value
+                  for name, value in params.items()}
+    digest = hashlib.sha256(json.dumps(normalized, sort_keys=True, default=str).encode()).hexdigest()
+    return f"{namespace}:{digest}"
+
+
+class ResponseCache:
+    """
+    The ResponseCache is a disk backed cache for API responses, so a reset or a "search another company"
+    loop does not pay for the same search or extraction again.
+
+    Responses are stored as JSON in a SQLite database and expire after ttl seconds. The database is bounded
+    to max_bytes of stored responses, the least recently used entries are evicted first. Hit and miss
+    counters are kept for the lifetime of the object, see stats().
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=24 * 60 * 60, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                key TEXT PRIMARY KEY,
+                                value TEXT NOT NULL,
+                                size INTEGER NOT NULL,
+                                created REAL NOT NULL,
+                                accessed REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        data = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                             (key, data, len(data), now, now))
+            self._evict()
+            self._db.commit()
+
+    def get_or_set(self, key, fetch, refresh=False):
+        """
+        Returns the cached response for key, or calls fetch() and caches its response. With refresh, fetch() is
+        called whatever is cached and its response replaces the cached one.
+        """
+        value = None if refresh else self.get(key)
+        if value is None:
+            value = fetch()
+            self.set(key, value)
+        return value
+
+    def _evict(self):
+        # Drop expired entries, then the least recently used ones until the cache fits in max_bytes
+        self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': entries,
+                'bytes': size}
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """
+    Returns the response cache shared by every agent in the process.
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache(os.environ.get('COMPANY_RESEARCHER_CACHE', DEFAULT_CACHE_PATH))
+        return _default_cache
@@ -0,0 +1,46 @@
+import os
+import sqlite3
+import threading
+
+# Location of the graph checkpoints, override with the COMPANY_RESEARCHER_CHECKPOINTS environment variable
+DEFAULT_CHECKPOINT_PATH = os.path.join('.cache', 'checkpoints.sqlite')
+
+_default_checkpointer = None
+_default_checkpointer_lock = threading.Lock()
+
+
+def open_checkpointer(path=DEFAULT_CHECKPOINT_PATH):
+    """
+    Opens a SQLite backed LangGraph checkpointer. The graph state is saved after every node, keyed by
+    the thread id of the run, so an interrupted or failed run can continue from its last completed node.
+    """
+    from langgraph.checkpoint.sqlite import SqliteSaver
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    # SqliteSaver locks around the connection itself, so concurrent runs can share it
+    return SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+
+
+def delete_thread(checkpointer, thread_id):
+    """
+    Deletes every checkpoint of a thread, once its run is done and will not be resumed.
+    The SqliteSaver of langgraph-checkpoint-sqlite 2.0 does not implement delete_thread itself.
+    """
+    from langgraph.checkpoint.sqlite import SqliteSaver
+    if not isinstance(checkpointer, SqliteSaver):
+        checkpointer.delete_thread(thread_id)
+        return
+    with checkpointer.cursor() as cursor:
+        cursor.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+        cursor.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+
+
+def get_default_checkpointer():
+    """
+    Returns the checkpointer shared by every researcher in the process.
+    """
+    global _default_checkpointer
+    with _default_checkpointer_lock:
+        if _default_checkpointer is None:
+            _default_checkpointer = open_checkpointer(os.environ.get('COMPANY_RESEARCHER_CHECKPOINTS', DEFAULT_CHECKPOINT_PATH))
+        return _default_checkpointer
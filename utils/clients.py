@@ -0,0 +1,338 @@
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from email.utils import parsedate_to_datetime
+from types import SimpleNamespace
+from utils.retry import CircuitBreaker, is_transient, retried_by_caller, sdk_errors
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+
+load_dotenv()
+
+# Keep-alive connections kept open per provider
+POOL_SIZE = 16
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at per_minute tokens a minute. It holds burst_seconds worth of tokens,
+    providers enforce their per minute limits over shorter windows, so a full minute's burst would be throttled.
+    reserve() takes the tokens right away and returns how long the caller has to wait before using them,
+    so waiting callers are served in order instead of racing for the next refill.
+    """
+    def __init__(self, per_minute, burst_seconds=10):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount, now):
+        # Must be called with the limiter's lock held
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= min(amount, self.capacity)
+        return max(0.0, -self.tokens / self.rate)
+
+
+class RateLimiter:
+    """
+    Rate limits of one provider shared by every caller in the process: requests per minute and tokens per
+    minute (either can be None for no limit). After a 429, pause() holds every caller back for the time
+    the provider asked for.
+    """
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self._lock = threading.Lock()
+        self.paused_until = 0.0
+        self.configure(requests_per_minute, tokens_per_minute)
+
+    def configure(self, requests_per_minute=None, tokens_per_minute=None):
+        with self._lock:
+            self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+            self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def _delay(self, tokens):
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self.paused_until - now)
+            if self.requests is not None:
+                delay = max(delay, self.requests.reserve(1, now))
+            if self.tokens is not None and tokens:
+                delay = max(delay, self.tokens.reserve(tokens, now))
+            return delay
+
+    def acquire(self, tokens=0):
+        delay = self._delay(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, tokens=0):
+        delay = self._delay(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def retry_after_seconds(headers, default):
+    """
+    Reads how long to wait from the retry-after-ms or retry-after (seconds or an HTTP date) header.
+    """
+    headers = headers or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return default
+
+
+def _rate_limit_wait(error, attempt, backoff):
+    # How long a rate limited provider asked us to wait, exponential backoff when it did not say
+    default = backoff * 2 ** attempt
+    response = getattr(error, 'response', None)
+    if response is not None and hasattr(response, 'headers'):
+        return retry_after_seconds(response.headers, default)
+    return getattr(error, 'retry_after', None) or default
+
+
+class RateLimited:
+    """
+    Base of the client wrappers: every call waits for the provider's rate limiter, and a rate limit error
+    pauses the limiter (for every caller) before the call is retried, up to max_retries times. Other transient
+    errors (timeouts, dropped connections, 5xx, see is_transient) are retried max_transient_retries times
+    with jittered exponential backoff, unless the caller retries them with a RetryPolicy. The SDKs' own
+    retries are turned off.
+    Calls go through the provider's circuit breaker, they fail right away while the provider is down.
+    """
+    def __init__(self, client, limiter, breaker=None, max_retries=5, max_transient_retries=2, backoff=1.0):
+        self.client = client
+        self.limiter = limiter
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.max_transient_retries = max_transient_retries
+        self.backoff = backoff
+
+    def _retry_wait(self, error, retries):
+        # The kind of retry ('rate_limit' or 'transient') and how long to wait before it, None to raise the error.
+        # retries counts the retries made so far per kind.
+        if isinstance(error, sdk_errors().rate_limit):
+            kind, limit = 'rate_limit', self.max_retries
+        elif is_transient(error):
+            kind, limit = 'transient', 0 if retried_by_caller() else self.max_transient_retries
+        else:
+            return None
+        if retries[kind] >= limit:
+            return None
+        if kind == 'rate_limit':
+            wait = _rate_limit_wait(error, retries[kind], self.backoff)
+        else:
+            wait = random.uniform(0, self.backoff * 2 ** retries[kind])
+        retries[kind] += 1
+        logging.error("%s, retrying in %.1fs (attempt %s/%s): %s", "Rate limited" if kind == 'rate_limit' else "Request failed",
+                      wait, retries[kind], limit, error)
+        return kind, wait
+
+    @contextmanager
+    def _breaker_call(self):
+        # One logical call (its 429 retries included) goes through the breaker once, and its outcome is
+        # recorded on every way out so a half open circuit is never left waiting on a trial
+        if self.breaker is None:
+            yield
+            return
+        self.breaker.before_call()
+        try:
+            yield
+        except Exception as e:
+            self.breaker.record_failure(e)
+            raise
+        except BaseException:
+            self.breaker.abandon()
+            raise
+        else:
+            self.breaker.record_success()
+
+    def _call(self, fn, args, kwargs, tokens=0):
+        retries = {'rate_limit': 0, 'transient': 0}
+        with self._breaker_call():
+            while True:
+                self.limiter.acquire(tokens)
+                try:
+                    return fn(*args, **kwargs)
+                except Exception as e:
+                    retry = self._retry_wait(e, retries)
+                    if retry is None:
+                        raise
+                    kind, wait = retry
+                    # A rate limit holds back every caller, a failed request only this one
+                    if kind == 'rate_limit':
+                        self.limiter.pause(wait)
+                    else:
+                        time.sleep(wait)
+
+    async def _call_async(self, fn, args, kwargs, tokens=0):
+        retries = {'rate_limit': 0, 'transient': 0}
+        with self._breaker_call():
+            while True:
+                await self.limiter.acquire_async(tokens)
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception as e:
+                    retry = self._retry_wait(e, retries)
+                    if retry is None:
+                        raise
+                    kind, wait = retry
+                    if kind == 'rate_limit':
+                        self.limiter.pause(wait)
+                    else:
+                        await asyncio.sleep(wait)
+
+
+def estimate_tokens(messages, max_tokens=None):
+    # What OpenAI counts against the tokens per minute limit: the prompt (about 4 characters a token)
+    # and the completion tokens requested
+    return sum(len(message.get('content') or '') for message in messages) // 4 + (max_tokens or 0)
+
+
+class RateLimitedTavily(RateLimited):
+    def search(self, query, **kwargs):
+        return self._call(self.client.search, (query,), kwargs)
+
+    def extract(self, urls, **kwargs):
+        return self._call(self.client.extract, (urls,), kwargs)
+
+
+class AsyncRateLimitedTavily(RateLimited):
+    async def search(self, query, **kwargs):
+        return await self._call_async(self.client.search, (query,), kwargs)
+
+    async def extract(self, urls, **kwargs):
+        return await self._call_async(self.client.extract, (urls,), kwargs)
+
+
+class RateLimitedOpenAI(RateLimited):
+    # Exposes chat.completions.create like the OpenAI client
+    def __init__(self, client, limiter, breaker=None, **kwargs):
+        super().__init__(client, limiter, breaker, **kwargs)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        return self._call(self.client.chat.completions.create, (), kwargs,
+                          estimate_tokens(kwargs.get('messages', []), kwargs.get('max_tokens')))
+
+
+class AsyncRateLimitedOpenAI(RateLimitedOpenAI):
+    async def _create(self, **kwargs):
+        return await self._call_async(self.client.chat.completions.create, (), kwargs,
+                                      estimate_tokens(kwargs.get('messages', []), kwargs.get('max_tokens')))
+
+
+# The clients are built on first use, importing their SDK only then
+def _tavily_client():
+    from utils.tavily_client import PooledTavilyClient
+    return PooledTavilyClient(api_key=os.environ.get("TAVILY_API_KEY"), pool_size=POOL_SIZE)
+
+
+def _async_tavily_client():
+    from utils.tavily_client import AsyncPooledTavilyClient
+    return AsyncPooledTavilyClient(api_key=os.environ.get("TAVILY_API_KEY"), pool_size=POOL_SIZE)
+
+
+def _openai_client():
+    import httpx
+    import openai
+    return openai.OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0,
+                         http_client=httpx.Client(limits=httpx.Limits(max_connections=POOL_SIZE,
+                                                                      max_keepalive_connections=POOL_SIZE)))
+
+
+def _async_openai_client():
+    import httpx
+    import openai
+    return openai.AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0,
+                              http_client=httpx.AsyncClient(limits=httpx.Limits(max_connections=POOL_SIZE,
+                                                                                max_keepalive_connections=POOL_SIZE)))
+
+
+def _env_limit(name):
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+class ClientRegistry:
+    """
+    The ClientRegistry builds one client per API and shares it between every agent, so HTTP connections are
+    kept alive and reused, and the provider's rate limits are applied across all concurrent researches.
+
+    Clients: 'tavily', 'openai' and their async variants 'async_tavily', 'async_openai'. The sync and async
+    clients of a provider share its RateLimiter. Limits default to the COMPANY_RESEARCHER_TAVILY_RPM,
+    COMPANY_RESEARCHER_OPENAI_RPM and COMPANY_RESEARCHER_OPENAI_TPM environment variables (no limit if unset).
+    The retries (429s and transient errors) are done here, the OpenAI SDK's own retries are turned off so
+    they are not repeated.
+    Each provider also has a CircuitBreaker (see utils/retry.py) shared by its sync and async clients.
+
+    Async clients hold connections bound to the event loop they are first used in.
+    """
+    providers = {'tavily': 'tavily', 'openai': 'openai', 'async_tavily': 'tavily', 'async_openai': 'openai'}
+    wrappers = {'tavily': RateLimitedTavily, 'openai': RateLimitedOpenAI,
+                'async_tavily': AsyncRateLimitedTavily, 'async_openai': AsyncRateLimitedOpenAI}
+
+    def __init__(self):
+        self.factories = {'tavily': _tavily_client, 'openai': _openai_client,
+                          'async_tavily': _async_tavily_client, 'async_openai': _async_openai_client}
+        self.limiters = {
+            'tavily': RateLimiter(_env_limit('COMPANY_RESEARCHER_TAVILY_RPM')),
+            'openai': RateLimiter(_env_limit('COMPANY_RESEARCHER_OPENAI_RPM'), _env_limit('COMPANY_RESEARCHER_OPENAI_TPM')),
+        }
+        self.breakers = {'tavily': CircuitBreaker('tavily'), 'openai': CircuitBreaker('openai')}
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            if name not in self._clients:
+                provider = self.providers[name]
+                self._clients[name] = self.wrappers[name](self.factories[name](), self.limiters[provider],
+                                                          self.breakers[provider])
+            return self._clients[name]
+
+    def register(self, name, factory):
+        # Replaces how a client is built (e.g. with a fake), it is still rate limited and circuit broken
+        with self._lock:
+            self.factories[name] = factory
+            self._clients.pop(name, None)
+
+    def set_rate_limit(self, provider, requests_per_minute=None, tokens_per_minute=None):
+        # Clients already built keep the limiter they were given, so it is updated in place
+        self.limiters[provider].configure(requests_per_minute, tokens_per_minute)
+
+
+_registry = ClientRegistry()
+
+
+def get_client(name):
+    """
+    Returns the shared client for 'tavily', 'openai', 'async_tavily' or 'async_openai'.
+    """
+    return _registry.get(name)
+
+
+def register_client(name, factory):
+    _registry.register(name, factory)
+
+
+def set_rate_limit(provider, requests_per_minute=None, tokens_per_minute=None):
+    """
+    Sets the requests and tokens per minute allowed for a provider ('tavily', 'openai'), None for no limit.
+    """
+    _registry.set_rate_limit(provider, requests_per_minute, tokens_per_minute)
@@ -0,0 +1,31 @@
+from contextlib import contextmanager
+import threading
+
+# Concurrency limits per external API, shared by every agent in the process.
+_api_limits = {}
+_api_limits_lock = threading.Lock()
+
+
+def set_api_limit(api, max_concurrent):
+    """
+    Caps the number of concurrent requests made to an api ('tavily', 'openai').
+    None removes the cap.
+    """
+    with _api_limits_lock:
+        if max_concurrent is None:
+            _api_limits.pop(api, None)
+        else:
+            _api_limits[api] = threading.BoundedSemaphore(max_concurrent)
+
+
+@contextmanager
+def api_slot(api):
+    """
+    Holds one of the api's concurrency slots for the duration of the block.
+    """
+    semaphore = _api_limits.get(api)
+    if semaphore is None:
+        yield
+        return
+    with semaphore:
+        yield
@@ -0,0 +1,82 @@
+from collections import defaultdict
+import hashlib
+import re
+
+
+def split_paragraphs(text):
+    return [paragraph.strip() for paragraph in re.split(r"\n\s*\n", text) if paragraph.strip()]
+
+
+def _normalize(paragraph):
+    return " ".join(re.findall(r"\w+", paragraph.lower()))
+
+
+def simhash(text, bits=64):
+    """
+    SimHash of a text's words, near duplicate texts differ in only a few bits.
+    """
+    features = text.split() or ['']
+    # Each bit of the SimHash is set when most feature hashes have it set, counted column by column
+    hashes = [format(int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=bits // 8).digest(), 'big'), f'0{bits}b')
+              for feature in features]
+    value = 0
+    for column in zip(*hashes):
+        value = value << 1 | (2 * column.count('1') > len(hashes))
+    return value
+
+
+class NearDuplicateIndex:
+    """
+    Index of SimHashes that answers "was a hash within max_distance bits seen before".
+    Hashes are split into max_distance + 1 bands, two hashes within max_distance bits share at least
+    one band exactly, so only hashes in the same band buckets are compared.
+    """
+    def __init__(self, max_distance=7, bits=64):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = bits // self.bands
+        self.buckets = defaultdict(list)
+
+    def _keys(self, value):
+        mask = (1 << self.band_bits) - 1
+        return [(band, value >> (band * self.band_bits) & mask) for band in range(self.bands)]
+
+    def seen(self, value):
+        return any(bin(value ^ other).count('1') <= self.max_distance
+                   for key in self._keys(value) for other in self.buckets[key])
+
+    def add(self, value):
+        for key in self._keys(value):
+            self.buckets[key].append(value)
+
+
+def deduplicate(texts, max_distance=7, min_chars=80):
+    """
+    Removes repeated passages across documents, e.g. syndicated press releases or mirrored profiles.
+    Texts are processed in the given order (put the preferred sources first) and split into paragraphs.
+    A paragraph is dropped when an exact (after normalizing case and punctuation) or near duplicate
+    (SimHash within max_distance bits) was kept earlier. Paragraphs shorter than min_chars are too short
+    to fingerprint reliably and are kept.
+    Returns the deduplicated texts, in the same order (an empty string when nothing is left of a text),
+    and the paragraphs that were removed.
+    """
+    exact = set()
+    near = NearDuplicateIndex(max_distance)
+    deduplicated = []
+    removed = []
+    for text in texts:
+        kept = []
+        for paragraph in split_paragraphs(text):
+            normalized = _normalize(paragraph)
+            if len(paragraph) < min_chars:
+                kept.append(paragraph)
+                continue
+            fingerprint = simhash(normalized)
+            if normalized in exact or near.seen(fingerprint):
+                removed.append(paragraph)
+                continue
+            exact.add(normalized)
+            near.add(fingerprint)
+            kept.append(paragraph)
+        deduplicated.append("\n\n".join(kept))
+    return deduplicated, removed
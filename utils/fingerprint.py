@@ -0,0 +1,53 @@
+from collections import defaultdict
+import random
+import re
+import zlib
+
+# Large prime for the MinHash permutations, and their fixed (a, b) coefficients so signatures are comparable
+# across runs and processes.
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_random = random.Random(1)
+_PERMUTATIONS = [(_random.randrange(1, _PRIME), _random.randrange(0, _PRIME)) for _ in range(128)]
+
+
+def shingles(text, size=5):
+    """
+    Returns the set of hashed word shingles (runs of size words) of a text.
+    Texts shorter than size words are a single shingle.
+    """
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {zlib.crc32(" ".join(words).encode())} if words else set()
+    return {zlib.crc32(" ".join(words[i:i + size]).encode()) for i in range(len(words) - size + 1)}
+
+
+def minhash(text, num_perm=64, size=5):
+    """
+    MinHash signature of a text's shingles, the fraction of equal positions between two signatures
+    estimates the Jaccard similarity of their shingle sets.
+    """
+    hashed = shingles(text, size)
+    if not hashed:
+        return [_MAX_HASH] * num_perm
+    return [min(((a * value + b) % _PRIME) & _MAX_HASH for value in hashed) for a, b in _PERMUTATIONS[:num_perm]]
+
+
+def similarity(signature, other):
+    return sum(1 for x, y in zip(signature, other) if x == y) / len(signature)
+
+
+def similar_pairs(signatures, threshold, bands=16):
+    """
+    Finds the pairs of signatures (by index) with an estimated similarity of at least threshold.
+    Signatures are bucketed by bands (locality sensitive hashing) so only candidates sharing a band are compared.
+    """
+    rows = len(signatures[0]) // bands if signatures else 0
+    buckets = defaultdict(list)
+    for index, signature in enumerate(signatures):
+        for band in range(bands):
+            buckets[(band, tuple(signature[band * rows:(band + 1) * rows]))].append(index)
+    candidates = {(first, second) for members in buckets.values() if len(members) > 1
+                  for i, first in enumerate(members) for second in members[i + 1:]}
+    return sorted((first, second) for first, second in candidates
+                  if similarity(signatures[first], signatures[second]) >= threshold)
@@ -0,0 +1,74 @@
+from utils.cache import get_default_cache, make_key
+from utils.tracing import increment_span_attribute
+import hashlib
+import threading
+
+
+def normalize_prompt(prompt):
+    """
+    Collapses whitespace, so prompts differing only in indentation or line breaks share a cache entry.
+    """
+    return " ".join(prompt.split())
+
+
+class LLMCache:
+    """
+    The LLMCache keeps OpenAI chat completions in the response cache (see ResponseCache, it is persistent,
+    entries expire after its ttl and the least recently used are evicted past its max_bytes), so summarizing
+    the same search results or writing a report from the same extracts again costs a cache lookup instead
+    of an LLM round trip.
+
+    Completions are keyed on the model, the system prompt, the sha256 of the normalized prompt and the
+    parameters of the call (e.g. max_tokens, which can truncate the completion).
+
+    With bypass, cached completions are not used but new ones still replace them, to force regeneration.
+    Hits and misses are counted on the object (see stats()) and in the current tracing span
+    (llm_cache_hits and llm_cache_misses).
+    """
+    namespace = 'openai.chat'
+
+    def __init__(self, cache=None, bypass=False):
+        self.cache = cache or get_default_cache()
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, model, system_prompt, prompt, **params):
+        prompt_hash = hashlib.sha256(normalize_prompt(prompt).encode()).hexdigest()
+        return make_key(self.namespace, model=model, system=system_prompt, prompt=prompt_hash, **params)
+
+    def get(self, key):
+        """
+        Returns the cached completion for key, None on a miss or when bypassed.
+        """
+        completion = None if self.bypass else self.cache.get(key)
+        with self._lock:
+            if completion is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        increment_span_attribute('llm_cache_misses' if completion is None else 'llm_cache_hits')
+        return completion
+
+    def set(self, key, completion):
+        # An empty completion is an error more often than an answer, it is not worth keeping
+        if completion:
+            self.cache.set(key, completion)
+
+    def complete(self, key, fetch):
+        """
+        Returns the cached completion for key, or calls fetch() and caches the completion it returns.
+        """
+        completion = self.get(key)
+        if completion is None:
+            completion = fetch()
+            self.set(key, completion)
+        return completion
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,74 @@
+import re
+
+HEADING = re.compile(r"^(#{1,6})\s+(.+?)\s*$")
+
+
+class MarkdownSectionTracker:
+    """
+    Follows markdown text as it streams in and reports each section (a heading and the text under it)
+    once it is complete, that is when the next heading starts or the stream ends.
+    """
+    def __init__(self):
+        self._line = ""
+        self._title = None
+        self._lines = []
+
+    def feed(self, delta):
+        """
+        Adds the next piece of the stream, returns the (title, text) of the sections it completed.
+        """
+        completed = []
+        self._line += delta
+        *lines, self._line = self._line.split("\n")
+        for line in lines:
+            completed.extend(self._add_line(line))
+        return completed
+
+    def close(self):
+        """
+        Ends the stream, returns the last section if there is one.
+        """
+        completed = []
+        if self._line:
+            completed.extend(self._add_line(self._line))
+            self._line = ""
+        if self._title is not None:
+            completed.append((self._title, "\n".join(self._lines).strip()))
+            self._title = None
+        return completed
+
+    def _add_line(self, line):
+        heading = HEADING.match(line)
+        if not heading:
+            self._lines.append(line)
+            return []
+        completed = []
+        if self._title is not None:
+            completed.append((self._title, "\n".join(self._lines).strip()))
+        self._title = heading.group(2)
+        self._lines = []
+        return completed
+
+
+SECTION_HEADING = re.compile(r"^##\s+(.+?)\s*$", re.MULTILINE)
+
+
+def split_sections(markdown):
+    """
+    Splits a report into what comes before its first '## ' heading (the title) and its (title, text) sections.
+    """
+    headings = list(SECTION_HEADING.finditer(markdown))
+    if not headings:
+        return markdown.strip(), []
+    sections = []
+    for heading, following in zip(headings, headings[1:] + [None]):
+        end = following.start() if following is not None else len(markdown)
+        sections.append((heading.group(1), markdown[heading.end():end].strip()))
+    return markdown[:headings[0].start()].strip(), sections
+
+
+def join_sections(preamble, sections):
+    # The inverse of split_sections
+    parts = [preamble] if preamble else []
+    parts.extend(f"## {title}\n{text}" for title, text in sections)
+    return "\n\n".join(parts)
@@ -0,0 +1,216 @@
+from langgraph.errors import NodeInterrupt
+from urllib.parse import urlparse
+from utils.tracing import human_wait
+import re
+
+
+class ResearchAborted(Exception):
+    """
+    Raised by a non-interactive operator when it cannot answer a question,
+    e.g. none of the search result groups matched the hints for a company.
+    """
+
+
+class DecisionPending(NodeInterrupt):
+    """
+    Raised by the ServiceOperator when the graph needs an answer that was not given yet. LangGraph stops the
+    run at the checkpoint before the asking node, the decision (a dict, see ServiceOperator) is what to ask.
+    """
+    def __init__(self, decision):
+        super().__init__(decision)
+        self.decision = decision
+
+
+class ConsoleOperator:
+    """
+    The ConsoleOperator is the person at the keyboard. Every decision the graph needs from a human
+    (which company to research, whether a summary is the right company, whether to search again)
+    is asked on the terminal with input(), the time spent waiting for an answer is traced as human wait.
+    """
+    def _input(self, prompt):
+        with human_wait():
+            return input(prompt)
+
+    def ask_company(self):
+        print("\n             🔍 COMPANY RESEARCHER 🔍")
+        print("           POWERED BY TAVILY and LANGCHAIN")
+        print("======================================================")
+        return self._input("\nPlease let us know what company you'd like to research: ")
+
+    def ask_retry_query(self):
+        return self._input("\n❗ Please try again, provide more detail on the company and avoid using abbreviations\n"
+                           "Query length may be too short. Min query length is 5 characters. ❗\n"
+                           "\nPlease let us know what company you'd like to research: ")
+
+    def confirm_company(self, summary, urls):
+        while True:
+            user_input = self._input(
+                "\n🔍 Is this the company you were looking for?\n"
+                "➡️ Type 'yes' to generate a more detailed summary.\n"
+                "➡️ Type 'no' if this is not the correct company.\n"
+                "➡️ Type 'reset' to reset the search.\n"
+                "📝 Your answer: "
+            )
+            if user_input in ['yes', 'no', 'reset']:
+                return user_input
+            print("Invalid input. Please try again.")
+
+    def ask_search_another(self, report_path=None):
+        while True:
+            user_input = self._input(
+                "\n🔍 Would you like to search for another company?\n"
+                "➡️ Type 'yes' to generate a more detailed summary.\n"
+                "➡️ Type 'no' if this is not the correct company.\n"
+                "📝 Your answer: ")
+            if user_input in ['yes', 'no']:
+                return user_input
+            print("Invalid input. Please try again.")
+
+    def search_hint(self):
+        # Nothing is known about the company besides the query typed
+        return None
+
+
+class BatchOperator:
+    """
+    The BatchOperator answers the graph's questions without a human so many companies can be researched
+    headless. The company name is given up front and the optional hints decide which search result group
+    is the right company:
+        domain: a known domain of the company, a group matches if one of its urls is on that domain.
+        description: a one line description, a group matches if its summary shares enough keywords with it.
+    Without hints the top ranked group is accepted. If no group matches, the research is aborted instead of
+    asking for a new query. The description is also the industry hint of the expanded search (see TavilySearch).
+    """
+    def __init__(self, company, domain=None, description=None, min_keyword_overlap=0.3):
+        self.company = company
+        self.domain = self._normalize_domain(domain) if domain else None
+        self.description = description
+        self.keywords = self._keywords(description) if description else set()
+        self.min_keyword_overlap = min_keyword_overlap
+        self._asked_company = False
+
+    def ask_company(self):
+        if self._asked_company:
+            raise ResearchAborted(f"No search result matched the hints for '{self.company}'")
+        self._asked_company = True
+        return self.company
+
+    def ask_retry_query(self):
+        raise ResearchAborted(f"The search for '{self.company}' failed")
+
+    def confirm_company(self, summary, urls):
+        if self.domain:
+            hosts = [self._normalize_domain(url) for url in urls]
+            if any(host == self.domain or host.endswith('.' + self.domain) for host in hosts):
+                return 'yes'
+            return 'no'
+        if self.keywords:
+            overlap = len(self.keywords & self._keywords(summary)) / len(self.keywords)
+            return 'yes' if overlap >= self.min_keyword_overlap else 'no'
+        return 'yes'
+
+    def ask_search_another(self, report_path=None):
+        return 'no'
+
+    def search_hint(self):
+        return self.description
+
+    @staticmethod
+    def _normalize_domain(value):
+        netloc = urlparse(value if '//' in value else f'//{value}').netloc.lower()
+        netloc = netloc.split(':')[0]
+        return netloc[4:] if netloc.startswith('www.') else netloc
+
+    @staticmethod
+    def _keywords(text):
+        return {word for word in re.findall(r"[a-z0-9]+", text.lower()) if len(word) > 3}
+
+
+class ServiceOperator:
+    """
+    The ServiceOperator answers the graph's questions with the answers an analyst gives through the research
+    service (see research_service.py), without blocking a thread while they decide. A question without an
+    answer raises DecisionPending, which suspends the run at its last checkpoint. Once the answer is in, the
+    run is resumed and the interrupted node runs again from its start.
+
+    Answers are kept per graph step, so the node run again gets the answers it was given before in the same
+    order and only the question after them is new. The company given up front answers the first question.
+
+    A decision is a dict with the kind of question ('company', 'retry_query', 'confirm_company' or
+    'search_another'), the question, the choices (None for free text) and what to decide on (the summary and
+    urls of a search result group, the report of a company).
+    """
+    choices = {'confirm_company': ['yes', 'no', 'reset'], 'search_another': ['yes', 'no']}
+
+    def __init__(self, company):
+        self.company = company
+        self.answers = {}
+        self.pending = None
+        self._first_step = None
+
+    def at_step(self, step):
+        # The operator a node run asks, the company answers the first one
+        if self._first_step is None:
+            self._first_step = step
+            self.answers[step] = [('company', self.company)]
+        return _StepOperator(self, step)
+
+    def answer(self, answer):
+        """
+        Answers the pending decision, raises ValueError if there is none or the answer is not one of its choices.
+        """
+        if self.pending is None:
+            raise ValueError("No decision is pending")
+        step, decision = self.pending
+        answer = (answer or '').strip()
+        if not answer or (decision['choices'] is not None and answer not in decision['choices']):
+            raise ValueError(f"Answer with one of {decision['choices']}" if decision['choices'] else "The answer is empty")
+        self.answers.setdefault(step, []).append((decision['kind'], answer))
+        self.pending = None
+
+
+class _StepOperator:
+    # Replays the answers given to one graph step, the first question after them is pending
+    def __init__(self, operator, step):
+        self.operator = operator
+        self.step = step
+        self._next = 0
+
+    def _ask(self, kind, question, **details):
+        answers = self.operator.answers.get(self.step, [])
+        if self._next < len(answers) and answers[self._next][0] == kind:
+            self._next += 1
+            return answers[self._next - 1][1]
+        # The node asked something else than last time, the answers left are not for this question
+        del answers[self._next:]
+        decision = dict(kind=kind, question=question, choices=self.operator.choices.get(kind), **details)
+        self.operator.pending = (self.step, decision)
+        raise DecisionPending(decision)
+
+    def ask_company(self):
+        return self._ask('company', "What company would you like to research?")
+
+    def ask_retry_query(self):
+        return self._ask('retry_query', "The search failed, please provide more detail on the company and avoid "
+                                        "abbreviations (at least 5 characters).")
+
+    def confirm_company(self, summary, urls):
+        return self._ask('confirm_company', "Is this the company you were looking for?", summary=summary, urls=urls)
+
+    def ask_search_another(self, report_path=None):
+        return self._ask('search_another', "Would you like to search for another company?", report_path=report_path)
+
+    def search_hint(self):
+        return None
+
+
+def get_operator(config):
+    """
+    Returns the operator passed in the run config, defaulting to the console.
+    """
+    configurable = (config or {}).get('configurable', {})
+    operator = configurable.get('operator') or ConsoleOperator()
+    if isinstance(operator, ServiceOperator):
+        # Its answers are kept per step, a node run again after an interruption has the same step
+        return operator.at_step((config.get('metadata') or {}).get('langgraph_step'))
+    return operator
@@ -0,0 +1,128 @@
+import io
+import re
+
+# Markdown links and bare urls
+LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)|https?://\S+|www\.\S+")
+# Phrases of cookie banners, legal footers and sign up prompts. One is not enough to drop a line, a paragraph
+# about a "subscribe-and-save model" is content
+BOILERPLATE = re.compile(r"\b(cookies?|accept all|privacy policy|terms of (use|service)|all rights reserved|"
+                         r"copyright|sign up|log ?in|subscribe|newsletter|skip to (main )?content)\b|©", re.IGNORECASE)
+# Lines that are boilerplate on their own
+SKIP_LINK = re.compile(r"skip to (main )?content\W*", re.IGNORECASE)
+
+
+def iter_blocks(lines):
+    """
+    Groups lines into blocks (paragraphs, lists, menus) separated by blank lines.
+    """
+    block = []
+    for line in lines:
+        if line.strip():
+            block.append(line)
+        elif block:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+def normalize_whitespace(blocks):
+    # Runs of spaces, tabs and non breaking spaces are one space, lines are stripped
+    for block in blocks:
+        yield [" ".join(line.split()) for line in block]
+
+
+def link_density(text):
+    """
+    The share of a text's characters that are in links.
+    """
+    return sum(len(link.group(0)) for link in LINK.finditer(text)) / max(len(text), 1)
+
+
+def boilerplate_markers(text):
+    """
+    The distinct boilerplate phrases of a text, "Cookies" and "cookie" or "Log in" and "login" are one.
+    """
+    return {"".join(match.group(0).lower().split()).rstrip('s') for match in BOILERPLATE.finditer(text)}
+
+
+def words(text):
+    # The words of a text, a link counts as the words of its label
+    return LINK.sub(r"\1", text).split()
+
+
+def drop_boilerplate(blocks, removed, min_words=4, max_link_density=0.5, max_boilerplate_words=50,
+                     min_boilerplate_markers=2, boilerplate_link_density=0.2):
+    """
+    Drops the lines that are mostly links (menus, link lists) and the short lines of cookie banners, legal
+    footers or sign up prompts (and skip links): min_boilerplate_markers different boilerplate phrases in the line and the
+    lines next to it, or one with links making more than boilerplate_link_density of the line. Lines are
+    judged one by one, many pages only break lines and a block is then the whole page. What is left of a
+    block is dropped if it has fewer than min_words words and is not a heading (buttons, breadcrumbs).
+    Dropped lines are appended to removed.
+    """
+    for block in blocks:
+        markers = [boilerplate_markers(line) if len(words(line)) <= max_boilerplate_words else set()
+                   for line in block]
+        kept = []
+        for i, line in enumerate(block):
+            density = link_density(line)
+            nearby = set().union(*markers[max(i - 1, 0):i + 2]) if markers[i] else set()
+            if (density > max_link_density
+                    or SKIP_LINK.fullmatch(line)
+                    or len(nearby) >= min_boilerplate_markers
+                    or (nearby and density > boilerplate_link_density)):
+                removed.append(line)
+            else:
+                kept.append(line)
+        if kept and len(words("\n".join(kept))) < min_words and not kept[0].startswith('#'):
+            removed.append("\n".join(kept))
+        elif kept:
+            yield kept
+
+
+def has_prose(text, min_words=4, max_link_density=0.5):
+    """
+    True if a line of the text has min_words words and is not mostly links.
+    """
+    return any(len(words(line)) >= min_words and link_density(line) <= max_link_density
+               for line in text.splitlines())
+
+
+def cap_size(blocks, max_chars, removed):
+    """
+    Keeps blocks until the page reaches max_chars, the block crossing the limit is cut and the rest is
+    appended to removed.
+    """
+    size = 0
+    for block in blocks:
+        text = "\n".join(block)
+        if size >= max_chars:
+            removed.append(text)
+            continue
+        if size + len(text) > max_chars:
+            removed.append(text[max_chars - size:])
+            text = text[:max_chars - size]
+        size += len(text) + 2
+        yield [text]
+
+
+def clean_page(text, max_chars=60_000, min_words=4, max_link_density=0.5):
+    """
+    Strips the boilerplate of an extracted page before it is stored and tokenized, one block at a time:
+    whitespace is normalized, menus, link lists, buttons and cookie banners are dropped and the page is capped
+    at max_chars. A page with prose is never cleaned down to nothing. Returns the cleaned page and the removed
+    lines and blocks (the whitespace removed is not in them).
+    """
+    removed = []
+    blocks = iter_blocks(io.StringIO(text))
+    blocks = normalize_whitespace(blocks)
+    blocks = drop_boilerplate(blocks, removed, min_words=min_words, max_link_density=max_link_density)
+    blocks = cap_size(blocks, max_chars, removed)
+    cleaned = "\n\n".join("\n".join(block) for block in blocks)
+    if not cleaned and has_prose(text, min_words, max_link_density):
+        # The page is laid out in a way the rules misread, better its boilerplate than no page at all
+        removed = []
+        blocks = cap_size(normalize_whitespace(iter_blocks(io.StringIO(text))), max_chars, removed)
+        cleaned = "\n\n".join("\n".join(block) for block in blocks)
+    return cleaned, removed
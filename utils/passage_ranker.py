@@ -0,0 +1,107 @@
+from collections import Counter
+from functools import lru_cache
+import math
+import re
+
+# Words too common to say anything about a passage's relevance
+STOPWORDS = set("""a an and are as at be by for from has have in is it its of on or that the this to was were will with
+which their they our we you your not but can all more about also into than other such only""".split())
+
+
+def terms(text):
+    return [word for word in re.findall(r"\w+", text.lower()) if word not in STOPWORDS and len(word) > 1]
+
+
+def split_passages(text, target_words=120):
+    """
+    Splits a page into passages of about target_words words, keeping paragraphs together where possible.
+    """
+    passages = []
+    current = []
+    current_words = 0
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        words = paragraph.split()
+        if not words:
+            continue
+        # Very long paragraphs are split on their own
+        if len(words) > 2 * target_words:
+            if current:
+                passages.append("\n\n".join(current))
+                current, current_words = [], 0
+            while len(words) > 2 * target_words:
+                passages.append(" ".join(words[:target_words]))
+                words = words[target_words:]
+            paragraph = " ".join(words)
+        current.append(paragraph)
+        current_words += len(words)
+        if current_words >= target_words:
+            passages.append("\n\n".join(current))
+            current, current_words = [], 0
+    if current:
+        passages.append("\n\n".join(current))
+    return passages
+
+
+class BM25:
+    """
+    Okapi BM25 index over a list of passages.
+    """
+    def __init__(self, passages, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_counts = [Counter(terms(passage)) for passage in passages]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0
+        document_frequency = Counter(term for counts in self.term_counts for term in counts)
+        total = len(passages)
+        self.idf = {term: math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+                    for term, frequency in document_frequency.items()}
+
+    def scores(self, query):
+        query_terms = set(terms(query))
+        scores = []
+        for counts, length in zip(self.term_counts, self.lengths):
+            normalization = self.k1 * (1 - self.b + self.b * length / (self.average_length or 1))
+            scores.append(sum(self.idf[term] * counts[term] * (self.k1 + 1) / (counts[term] + normalization)
+                              for term in query_terms if term in counts))
+        return scores
+
+
+@lru_cache(maxsize=2)
+def _embedding_model(name):
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError as e:
+        raise ImportError("Embedding passage ranking needs the sentence-transformers package: "
+                          "pip install sentence-transformers") from e
+    return SentenceTransformer(name)
+
+
+def embedding_scores(passages, query, model_name="all-MiniLM-L6-v2"):
+    """
+    Cosine similarity between the query and every passage with a local sentence-transformers model.
+    """
+    model = _embedding_model(model_name)
+    query_embedding = model.encode([query], normalize_embeddings=True)[0]
+    passage_embeddings = model.encode(passages, normalize_embeddings=True)
+    return [float(score) for score in passage_embeddings @ query_embedding]
+
+
+def rank_passages(texts, query, method='bm25', target_words=120, model_name="all-MiniLM-L6-v2"):
+    """
+    Splits the texts into passages and scores them against the query, with BM25 or a local embedding model.
+    Returns (passages, scores, positions), positions being the (text index, passage index) of each passage.
+    """
+    passages, positions = [], []
+    for text_index, text in enumerate(texts):
+        for passage_index, passage in enumerate(split_passages(text, target_words)):
+            passages.append(passage)
+            positions.append((text_index, passage_index))
+    if not passages:
+        return [], [], []
+    if method == 'embedding':
+        scores = embedding_scores(passages, query, model_name)
+    else:
+        scores = BM25(passages).scores(query)
+    return passages, scores, positions
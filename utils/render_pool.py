@@ -0,0 +1,147 @@
+from concurrent.futures import ProcessPoolExecutor, wait
+import atexit
+import multiprocessing
+import os
+import threading
+
+# Report formats the renderer can write, in the order they are preferred as the report path
+REPORT_FORMATS = ('pdf', 'html', 'md')
+
+
+def check_formats(formats):
+    """
+    The report formats to write, in REPORT_FORMATS order. Raises ValueError for an unknown format or no format,
+    so a bad option fails before the research is paid for rather than when the report is rendered.
+    """
+    unknown = [report_format for report_format in formats if report_format not in REPORT_FORMATS]
+    if unknown:
+        raise ValueError(f"Unknown report format {', '.join(map(repr, unknown))}, expected pdf, html or md")
+    if not formats:
+        raise ValueError("No report format given, expected pdf, html or md")
+    return [report_format for report_format in REPORT_FORMATS if report_format in formats]
+
+
+def convert_html_to_pdf(source_html, output_filename):
+    # Convert HTML to PDF using xhtml2pdf
+    from xhtml2pdf import pisa
+    with open(output_filename, "w+b") as result_file:
+        pisa_status = pisa.CreatePDF(source_html, dest=result_file)
+    return pisa_status.err
+
+
+def render_report(markdown_content, output_base, formats):
+    """
+    Writes the markdown report as <output_base>.<format> for each of the formats ('pdf', 'html', 'md').
+    Runs in a worker process of the render pool, so it only takes and returns plain values.
+    Returns the paths written per format. On failure, the files of the report (the empty ones reserved for it
+    and the ones already written) are removed.
+    """
+    try:
+        return _write_report(markdown_content, output_base, formats)
+    except BaseException:
+        for report_format in formats:
+            try:
+                os.remove(f"{output_base}.{report_format}")
+            except FileNotFoundError:
+                pass
+        raise
+
+
+def _write_report(markdown_content, output_base, formats):
+    import markdown2
+    paths = {}
+    if 'md' in formats:
+        paths['md'] = f"{output_base}.md"
+        with open(paths['md'], 'w') as f:
+            f.write(markdown_content)
+    if 'html' in formats or 'pdf' in formats:
+        # Convert markdown to HTML
+        html_content = markdown2.markdown(markdown_content)
+        if 'html' in formats:
+            paths['html'] = f"{output_base}.html"
+            with open(paths['html'], 'w') as f:
+                f.write(html_content)
+        if 'pdf' in formats:
+            paths['pdf'] = f"{output_base}.pdf"
+            if convert_html_to_pdf(html_content, paths['pdf']):
+                raise RuntimeError(f"xhtml2pdf could not render {paths['pdf']}")
+    return paths
+
+
+def _load_renderer():
+    # Runs in a fresh worker so the first report does not pay for the renderer imports
+    import markdown2
+    from xhtml2pdf import pisa
+
+
+class RenderPool:
+    """
+    The RenderPool renders reports in separate processes, so CPU heavy PDF rendering runs on every core and
+    overlaps with the network bound research instead of holding up the graph.
+
+    submit() returns a future with the paths written, drain() waits for every outstanding render.
+    warm_up() starts a worker ahead of the first report, e.g. while the report is still being generated.
+    Worker processes are spawned rather than forked since the researcher runs its own threads.
+    """
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._warm = False
+
+    def _get_executor(self):
+        # Must be called with the lock held
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def warm_up(self):
+        with self._lock:
+            if not self._warm:
+                self._warm = True
+                self._get_executor().submit(_load_renderer)
+
+    def submit(self, markdown_content, output_base, formats):
+        with self._lock:
+            future = self._get_executor().submit(render_report, markdown_content, output_base, tuple(formats))
+            self._pending.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def _discard(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def drain(self, timeout=None):
+        """
+        Waits for the outstanding renders, returns the ones that did not finish within timeout.
+        """
+        with self._lock:
+            pending = list(self._pending)
+        return wait(pending, timeout=timeout).not_done
+
+    def shutdown(self):
+        self.drain()
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+                self._warm = False
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    """
+    Returns the render pool shared by the process, it is drained when the interpreter exits.
+    """
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = RenderPool()
+            atexit.register(_default_pool.shutdown)
+        return _default_pool
@@ -0,0 +1,47 @@
+from utils.cache import normalize_query
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+
+def content_hash(text):
+    return hashlib.sha256((text or '').encode()).hexdigest()
+
+
+class ReportStore:
+    """
+    The ReportStore keeps what refreshing a report needs next to the reports, in <save_dir>/.refresh: for every
+    company researched (keyed on the normalized query) the path and markdown of its last report and, per url it
+    was written from, the hash of the search snippet and the blob key of the extracted page (see BlobStore, the
+    key is the sha256 of the page so it doubles as the content hash).
+
+    One JSON file per company, written to a temporary name and renamed so concurrent batch workers never
+    read a partial record.
+    """
+    def __init__(self, save_dir='pdfs'):
+        self.path = os.path.join(save_dir, '.refresh')
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, query):
+        return os.path.join(self.path, content_hash(normalize_query(query)) + '.json')
+
+    def load(self, query):
+        """
+        Returns the record of the last report for the query, None if there is none.
+        """
+        try:
+            with open(self._file(query)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, query, report_path, markdown, search_results):
+        record = {'query': query, 'report_path': report_path, 'markdown': markdown, 'updated': time.time(),
+                  'pages': {result.url: {'snippet': content_hash(result.content), 'content': result.raw_content_key}
+                            for result in search_results if result.raw_content_key}}
+        fd, tmp_path = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(record, f)
+        os.replace(tmp_path, self._file(query))
@@ -0,0 +1,156 @@
+from functools import lru_cache
+from types import SimpleNamespace
+from utils.tracing import increment_span_attribute
+import contextvars
+import logging
+import random
+import threading
+import time
+
+# Set while a RetryPolicy calls its function, the calls made in it are retried by the policy only
+_retrying = contextvars.ContextVar('retrying', default=False)
+
+
+class CircuitOpenError(Exception):
+    # Raised instead of calling a provider whose circuit is open, it is not retried
+    def __init__(self, provider, retry_in):
+        super().__init__(f"{provider} is failing, not calling it for another {retry_in:.0f}s")
+        self.provider = provider
+        self.retry_in = retry_in
+
+
+@lru_cache(maxsize=1)
+def sdk_errors():
+    """
+    The error classes of the SDKs: rate_limit (the provider asks to slow down) and transient (worth retrying,
+    the rate limits included). The SDKs are imported when the first error is classified, not at startup.
+    """
+    import httpx
+    import openai
+    import requests
+    from tavily.errors import UsageLimitExceededError
+    rate_limit = (openai.RateLimitError, UsageLimitExceededError)
+    transient = (TimeoutError, ConnectionError, requests.ConnectionError, requests.Timeout, httpx.TransportError,
+                 openai.APIConnectionError, openai.InternalServerError) + rate_limit
+    return SimpleNamespace(rate_limit=rate_limit, transient=transient)
+
+
+def retried_by_caller():
+    """
+    True when the current call runs inside RetryPolicy.call, which retries it on transient errors. The retries
+    of nested policies and of the clients are skipped then, the attempts of each layer would multiply.
+    """
+    return _retrying.get()
+
+
+def is_transient(error):
+    """
+    True for errors worth retrying: timeouts, dropped connections, rate limits and 5xx responses. Anything
+    else (a bad request, an invalid API key, a bug, an open circuit) is permanent and fails right away.
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, sdk_errors().transient):
+        return True
+    # The HTTP errors of requests and the OpenAI SDK carry their response
+    status = getattr(getattr(error, 'response', None), 'status_code', None) or getattr(error, 'status_code', None)
+    return isinstance(status, int) and (status >= 500 or status == 429)
+
+
+class RetryPolicy:
+    """
+    How a failing graph node (or call) is retried: up to max_attempts attempts for transient errors (see
+    is_transient), waiting initial_backoff seconds doubled after every attempt, at most max_backoff, with
+    full jitter so concurrent researches do not retry in step.
+
+    Every retry and the time it cost (the failed attempts and the waits) are added to the current tracing
+    span as retries and retry_seconds. A policy called inside another one does not retry, the outer one does.
+    """
+    def __init__(self, max_attempts=3, initial_backoff=1.0, max_backoff=30.0, jitter=True, retry_on=is_transient):
+        self.max_attempts = max_attempts
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_on = retry_on
+
+    def backoff(self, attempt):
+        backoff = min(self.max_backoff, self.initial_backoff * 2 ** attempt)
+        return random.uniform(0, backoff) if self.jitter else backoff
+
+    def call(self, fn, *args, name=None):
+        """
+        Calls fn(*args), retrying it on transient errors. The last error is raised once the attempts are used up.
+        name is what the retries are logged as, the name of fn by default.
+        """
+        if retried_by_caller():
+            return fn(*args)
+        token = _retrying.set(True)
+        try:
+            for attempt in range(self.max_attempts):
+                start = time.perf_counter()
+                try:
+                    return fn(*args)
+                except Exception as e:
+                    if attempt + 1 >= self.max_attempts or not self.retry_on(e):
+                        raise
+                    wait = self.backoff(attempt)
+                    logging.error("%s failed, retrying in %.1fs (attempt %s/%s): %s", name or fn.__name__,
+                                  wait, attempt + 1, self.max_attempts, e)
+                    time.sleep(wait)
+                    increment_span_attribute('retries')
+                    increment_span_attribute('retry_seconds', round(time.perf_counter() - start, 6))
+        finally:
+            _retrying.reset(token)
+
+
+class CircuitBreaker:
+    """
+    The CircuitBreaker stops calling a provider that is down. After failure_threshold transient failures in a
+    row the circuit opens: calls fail right away with CircuitOpenError instead of waiting on timeouts, for
+    reset_seconds. Then one call is let through (half open), closing the circuit if it succeeds and opening
+    it again if it fails.
+    """
+    def __init__(self, provider, failure_threshold=5, reset_seconds=30.0):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            retry_in = self.opened_at + self.reset_seconds - time.monotonic()
+            if retry_in > 0 or self._trial:
+                raise CircuitOpenError(self.provider, max(retry_in, 0))
+            # Half open, this call decides
+            self._trial = True
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logging.error("%s is responding again, closing its circuit", self.provider)
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def abandon(self):
+        # The call ended without an outcome (e.g. interrupted), a half open circuit lets the next call decide
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self, error):
+        # Only transient errors say the provider is down, it answered a bad request
+        if not is_transient(error):
+            self.record_success()
+            return
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                logging.error("%s failed %s times in a row, opening its circuit for %.0fs: %s",
+                              self.provider, self.failures, self.reset_seconds, error)
+                self.opened_at = time.monotonic()
+            self._trial = False
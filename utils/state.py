@@ -1,17 +1,61 @@
-from typing import TypedDict, Sequence, Union, List
+from dataclasses import dataclass
+from typing import TypedDict, Sequence, Union, List, Dict, Optional
 from typing import Annotated
+from langchain_core.messages import HumanMessage
 from langgraph.graph.message import add_messages
 
+
+@dataclass(slots=True)
+class SearchResult:
+    """
+    A search result kept in the state. The raw content of its page is not held here, it is stored in the
+    blob store (see utils/blob_store.py) under raw_content_key, so the state stays small however large
+    the pages are.
+    content: The snippet returned by the search.
+    relevance: 'yes' or 'no' once the user answered for the result's group, '' before.
+    summary: The summary of the result's group, the confirmed company's summary for focused search results.
+    raw_content_bytes: The size of the extracted page, 0 when it was not extracted.
+    removed_bytes, removed_tokens: What cleaning the page removed (boilerplate, whitespace, what was past the cap).
+    extract_seconds: How long the extraction batch of the result took.
+    extract_error: Why the result has no raw content.
+    """
+    url: str
+    content: str
+    score: float = 0.0
+    relevance: str = ''
+    summary: str = ''
+    raw_content_key: Optional[str] = None
+    raw_content_bytes: int = 0
+    removed_bytes: int = 0
+    removed_tokens: int = 0
+    extract_seconds: Optional[float] = None
+    extract_error: Optional[str] = None
+
+
 class State(TypedDict):
     """
     The State class is used to store the state of the graph.
-    messages: A list of messages used to store the states of the 
-              workflow which dictate the flow of the graph. 
-    search_results: A list of search results from the tavily search agent.
+    messages: The query typed by the user and the final summary. The search starts them over for every
+              new query, so they do not grow with the number of searches.
+    route: The node the last agent sends the graph to, read by the conditional edges.
+    search_results: The SearchResults of the latest search.
+    company_name: The company name taken from the title of the final summary.
+    report_path: The path of the report written by the convert to pdf agent.
+    report_status: 'new', or in refresh mode 'updated' or 'unchanged' when the company had a report before.
+    group_summaries: The summaries of the search result groups already generated, keyed on the query and the
+                     urls of the group, so retrying the same query after a reset or a failure reuses them.
     """
     messages: Annotated[list, add_messages]
-    search_results: List[str]
+    route: str
+    search_results: List[SearchResult]
+    company_name: str
+    report_path: str
+    report_status: str
+    group_summaries: Dict[str, str]
 
 
-    
-    
\ No newline at end of file
+def get_search_query(state):
+    """
+    Returns the latest query typed by the user (or the batch operator).
+    """
+    return [message for message in state['messages'] if type(message) == HumanMessage][-1].content
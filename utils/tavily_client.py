@@ -0,0 +1,80 @@
+from tavily import TavilyClient
+from tavily.errors import BadRequestError, InvalidAPIKeyError, UsageLimitExceededError
+from utils.clients import retry_after_seconds
+import httpx
+import json
+import os
+import requests
+
+
+class TavilyRateLimitError(UsageLimitExceededError):
+    # A 429 from Tavily, with the wait the response asked for (None if it did not say)
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _tavily_response(response):
+    # The error handling of the Tavily SDK, plus the retry-after of a 429
+    if response.status_code == 200:
+        return response.json()
+    detail = None
+    try:
+        detail = response.json()['detail']['error']
+    except Exception:
+        pass
+    if response.status_code == 400:
+        raise BadRequestError(detail or 'Bad request. The request was invalid or cannot be served.')
+    if response.status_code == 401:
+        raise InvalidAPIKeyError()
+    if response.status_code == 429:
+        raise TavilyRateLimitError(detail or 'Too many requests.', retry_after_seconds(response.headers, None))
+    response.raise_for_status()
+
+
+class PooledTavilyClient(TavilyClient):
+    """
+    TavilyClient sending its requests over a keep-alive connection pool instead of a new connection per call.
+    """
+    def __init__(self, api_key=None, pool_size=16):
+        super().__init__(api_key=api_key)
+        self.session = requests.Session()
+        self.session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    def _post(self, path, data):
+        response = self.session.post(self.base_url + path, data=json.dumps(dict(data, api_key=self.api_key)),
+                                     headers=self.headers, timeout=100)
+        return _tavily_response(response)
+
+    def _search(self, query, **kwargs):
+        return self._post("/search", dict(kwargs, query=query))
+
+    def _extract(self, urls, **kwargs):
+        return self._post("/extract", dict(kwargs, urls=urls))
+
+
+class AsyncPooledTavilyClient:
+    """
+    Async Tavily client with the search and extract methods of TavilyClient, over a pooled httpx.AsyncClient.
+    """
+    base_url = "https://api.tavily.com"
+
+    def __init__(self, api_key=None, pool_size=16):
+        self.api_key = api_key or os.environ.get("TAVILY_API_KEY")
+        self.http_client = httpx.AsyncClient(timeout=100, limits=httpx.Limits(max_connections=pool_size,
+                                                                             max_keepalive_connections=pool_size))
+
+    async def _post(self, path, data):
+        response = await self.http_client.post(self.base_url + path, json=dict(data, api_key=self.api_key))
+        return _tavily_response(response)
+
+    async def search(self, query, search_depth="basic", max_results=5, **kwargs):
+        response = await self._post("/search", dict(kwargs, query=query, search_depth=search_depth, max_results=max_results))
+        response.setdefault("results", [])
+        return response
+
+    async def extract(self, urls, **kwargs):
+        response = await self._post("/extract", dict(kwargs, urls=urls))
+        response.setdefault("results", [])
+        response.setdefault("failed_results", [])
+        return response
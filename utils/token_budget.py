@@ -0,0 +1,51 @@
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model="gpt-3.5-turbo"):
+    """
+    Returns the tiktoken encoding of a model, tiktoken is imported and the BPE loaded once per process,
+    the first time a prompt is counted.
+    """
+    import tiktoken
+    return tiktoken.encoding_for_model(model)
+
+
+def encode_all(tokenizer, texts):
+    """
+    Tokenizes every text once, using the tokenizer's batch encoding when it has one.
+    Special token strings found in web pages are encoded as plain text.
+    """
+    if hasattr(tokenizer, 'encode_batch'):
+        return tokenizer.encode_batch(texts, disallowed_special=())
+    return [tokenizer.encode(text, disallowed_special=()) for text in texts]
+
+
+def pack_by_priority(tokenizer, texts, priorities, budget, separator_tokens=1, min_tail_tokens=100, keep_order=False):
+    """
+    Selects the texts to send to the model within a token budget.
+    Texts are taken by descending priority (e.g. the Tavily score) until the budget is used up. The first
+    text that does not fit is truncated at a token boundary instead of dropped, unless less than
+    min_tail_tokens would be left of it. Returns the selected texts, highest priority first (in their
+    original order with keep_order), and the number of tokens they use.
+    """
+    encoded = encode_all(tokenizer, texts)
+    order = sorted(range(len(texts)), key=lambda i: priorities[i], reverse=True)
+    selected = []
+    used = 0
+    for i in order:
+        remaining = budget - used - separator_tokens
+        if remaining <= 0:
+            break
+        tokens = encoded[i]
+        if len(tokens) <= remaining:
+            selected.append((i, texts[i]))
+            used += len(tokens) + separator_tokens
+            continue
+        if remaining >= min_tail_tokens:
+            selected.append((i, tokenizer.decode(tokens[:remaining])))
+            used += remaining + separator_tokens
+        break
+    if keep_order:
+        selected.sort()
+    return [text for _, text in selected], used
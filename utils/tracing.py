@@ -0,0 +1,237 @@
+from collections import defaultdict
+from contextlib import contextmanager
+import argparse
+import contextvars
+import inspect
+import json
+import math
+import threading
+import time
+
+# The span of the graph node currently running, worker threads get it through in_current_context()
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """
+    A Span records what happened while one graph node ran: wall time, time spent waiting on a human,
+    latency of the external calls made and the OpenAI tokens used.
+    Agents may add to it from worker threads, so updates are locked.
+    """
+    def __init__(self, node, run_id):
+        self.node = node
+        self.run_id = run_id
+        self.start = time.time()
+        self.human_wait_seconds = 0.0
+        self.external = defaultdict(lambda: {'calls': 0, 'seconds': 0.0})
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.attributes = {}
+        self._lock = threading.Lock()
+
+    def add_external_call(self, kind, seconds):
+        with self._lock:
+            self.external[kind]['calls'] += 1
+            self.external[kind]['seconds'] += seconds
+
+    def add_human_wait(self, seconds):
+        with self._lock:
+            self.human_wait_seconds += seconds
+
+    def add_usage(self, prompt_tokens, completion_tokens):
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def set_attribute(self, name, value):
+        with self._lock:
+            self.attributes[name] = value
+
+    def increment_attribute(self, name, amount):
+        with self._lock:
+            self.attributes[name] = self.attributes.get(name, 0) + amount
+
+    def to_record(self, wall_seconds):
+        with self._lock:
+            return {'run_id': self.run_id,
+                    'node': self.node,
+                    'start': self.start,
+                    'wall_seconds': round(wall_seconds, 6),
+                    'human_wait_seconds': round(self.human_wait_seconds, 6),
+                    'external': {kind: {'calls': call['calls'], 'seconds': round(call['seconds'], 6)}
+                                 for kind, call in self.external.items()},
+                    'openai_prompt_tokens': self.prompt_tokens,
+                    'openai_completion_tokens': self.completion_tokens,
+                    **self.attributes}
+
+
+@contextmanager
+def external_call(kind):
+    """
+    Times an external API call (e.g. 'tavily.search', 'openai.chat') into the current span.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        span = _current_span.get()
+        if span is not None:
+            span.add_external_call(kind, time.perf_counter() - start)
+
+
+@contextmanager
+def human_wait():
+    """
+    Times a wait on the human in the loop into the current span.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        span = _current_span.get()
+        if span is not None:
+            span.add_human_wait(time.perf_counter() - start)
+
+
+def record_openai_usage(response):
+    """
+    Adds the prompt and completion tokens of an OpenAI response to the current span.
+    """
+    span = _current_span.get()
+    usage = getattr(response, 'usage', None)
+    if span is not None and usage is not None:
+        span.add_usage(usage.prompt_tokens or 0, usage.completion_tokens or 0)
+
+
+def set_span_attribute(name, value):
+    """
+    Adds an attribute (e.g. tokens saved by a processing step) to the record of the current span.
+    """
+    span = _current_span.get()
+    if span is not None:
+        span.set_attribute(name, value)
+
+
+def increment_span_attribute(name, amount=1):
+    """
+    Adds to a counting attribute (e.g. cache hits) of the record of the current span.
+    """
+    span = _current_span.get()
+    if span is not None:
+        span.increment_attribute(name, amount)
+
+
+def in_current_context(fn):
+    """
+    Wraps fn so it runs with the caller's span when it is called from a worker thread.
+    """
+    context = contextvars.copy_context()
+    def run(*args, **kwargs):
+        # Each call gets its own copy, a context cannot be entered by two threads at once
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+class Tracer:
+    """
+    The Tracer wraps every node of the graph in a span and appends one JSON line per node run to path.
+    Besides the span measurements, each record has the number of search results in the state and the bytes
+    of raw_content extracted for them.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def wrap_node(self, node, fn):
+        accepts_config = 'config' in inspect.signature(fn).parameters
+
+        def traced(state, config=None):
+            run_id = (config or {}).get('configurable', {}).get('run_id')
+            span = Span(node, run_id)
+            token = _current_span.set(span)
+            start = time.perf_counter()
+            error = None
+            try:
+                result = fn(state, config) if accepts_config else fn(state)
+                return result
+            except Exception as e:
+                error = e
+                result = state
+                raise
+            finally:
+                _current_span.reset(token)
+                record = span.to_record(time.perf_counter() - start)
+                record.update(self._state_attributes(result))
+                if error is not None:
+                    record['error'] = repr(error)
+                self.write(record)
+        return traced
+
+    def _state_attributes(self, state):
+        search_results = (state or {}).get('search_results') or []
+        return {'search_results': len(search_results),
+                'raw_content_bytes': sum(result.raw_content_bytes for result in search_results)}
+
+    def write(self, record):
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + "\n")
+
+
+def percentile(values, fraction):
+    # Nearest rank percentile, values must be sorted
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def summarize(paths):
+    """
+    Aggregates trace files into per node statistics across runs.
+    """
+    by_node = defaultdict(list)
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    by_node[record['node']].append(record)
+    summary = {}
+    for node, records in by_node.items():
+        wall = sorted(record['wall_seconds'] for record in records)
+        active = sorted(record['wall_seconds'] - record['human_wait_seconds'] for record in records)
+        external = sorted(sum((call['seconds'] for call in record['external'].values()), 0.0) for record in records)
+        ttft = sorted(record['ttft_seconds'] for record in records if 'ttft_seconds' in record)
+        llm_cache_hits = sum(record.get('llm_cache_hits', 0) for record in records)
+        llm_cache_lookups = llm_cache_hits + sum(record.get('llm_cache_misses', 0) for record in records)
+        summary[node] = {'runs': len(records),
+                         'errors': sum(1 for record in records if 'error' in record),
+                         'wall_p50': percentile(wall, 0.5),
+                         'wall_p95': percentile(wall, 0.95),
+                         'active_p50': percentile(active, 0.5),
+                         'active_p95': percentile(active, 0.95),
+                         'external_p50': percentile(external, 0.5),
+                         'external_p95': percentile(external, 0.95),
+                         'ttft_p50': percentile(ttft, 0.5),
+                         'ttft_p95': percentile(ttft, 0.95),
+                         'prompt_tokens': sum(record['openai_prompt_tokens'] for record in records),
+                         'completion_tokens': sum(record['openai_completion_tokens'] for record in records),
+                         'raw_content_bytes': sum(record.get('raw_content_bytes', 0) for record in records),
+                         'retries': sum(record.get('retries', 0) for record in records),
+                         'retry_seconds': sum(record.get('retry_seconds', 0.0) for record in records),
+                         'llm_hit_rate': llm_cache_hits / llm_cache_lookups if llm_cache_lookups else 0.0}
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize CompanyResearcher traces per graph node.")
+    parser.add_argument("traces", nargs="+", help="JSONL trace files")
+    args = parser.parse_args()
+
+    columns = ['runs', 'errors', 'wall_p50', 'wall_p95', 'active_p50', 'active_p95', 'external_p50', 'external_p95',
+               'ttft_p50', 'ttft_p95', 'prompt_tokens', 'completion_tokens', 'raw_content_bytes', 'llm_hit_rate',
+               'retries', 'retry_seconds']
+    print(f"{'node':<24}" + "".join(f"{column:>18}" for column in columns))
+    for node, stats in summarize(args.traces).items():
+        print(f"{node:<24}" + "".join(f"{stats[column]:>18.3f}" if isinstance(stats[column], float) else f"{stats[column]:>18}"
+                                      for column in columns))
@@ -1,78 +1,174 @@
 from urllib.parse import urlparse
-from urllib.parse import urlparse
 from collections import defaultdict
+from functools import lru_cache
+from utils.fingerprint import minhash, shingles, similar_pairs
+import ipaddress
+import os
 import re
 
+# Bundled copy of the public suffix list, set COMPANY_RESEARCHER_PSL to use another (e.g. the full list)
+PUBLIC_SUFFIX_LIST_PATH = os.environ.get('COMPANY_RESEARCHER_PSL',
+                                         os.path.join(os.path.dirname(__file__), 'public_suffix_list.dat'))
+
+# What an IP address could look like, checked before parsing it
+IP_LIKE = re.compile(r"[0-9.]+|.*:.*")
+
+
+def is_ip_address(hostname):
+    # Most hosts are names, only the ones that could be addresses are parsed
+    if not IP_LIKE.fullmatch(hostname):
+        return False
+    try:
+        ipaddress.ip_address(hostname)
+        return True
+    except ValueError:
+        return False
+
+
+class PublicSuffixList:
+    """
+    The PublicSuffixList finds the registrable domain (eTLD+1) of a hostname following the rules of
+    https://publicsuffix.org, so blog.example.com and www.example.com are both example.com while
+    example.co.uk is not grouped under "co".
+    """
+    def __init__(self, path=PUBLIC_SUFFIX_LIST_PATH):
+        self.rules = set()
+        self.wildcards = set()
+        self.exceptions = set()
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                rule = line.split()[0] if line.split() else ''
+                if not rule or rule.startswith('//'):
+                    continue
+                if rule.startswith('!'):
+                    self.exceptions.add(rule[1:])
+                elif rule.startswith('*.'):
+                    self.wildcards.add(rule[2:])
+                else:
+                    self.rules.add(rule)
+
+    def public_suffix(self, labels):
+        # The longest matching rule wins, an exception rule removes its leftmost label from the suffix
+        for i in range(len(labels)):
+            candidate = '.'.join(labels[i:])
+            if candidate in self.exceptions:
+                return '.'.join(labels[i + 1:])
+            if candidate in self.rules or '.'.join(labels[i + 1:]) in self.wildcards:
+                return candidate
+        # Unlisted top level domains are public suffixes by default
+        return labels[-1]
+
+    def registrable_domain(self, hostname):
+        hostname = hostname.lower().rstrip('.')
+        if is_ip_address(hostname):
+            return hostname
+        labels = hostname.split('.')
+        suffix = self.public_suffix(labels)
+        suffix_labels = suffix.count('.') + 1
+        if len(labels) <= suffix_labels:
+            return hostname
+        return '.'.join(labels[-suffix_labels - 1:])
+
+
+@lru_cache(maxsize=1)
+def get_public_suffix_list():
+    return PublicSuffixList()
+
+
+def registrable_domain(url):
+    """
+    Returns the registrable domain of a url, e.g. https://blog.example.co.uk/post -> example.co.uk
+    """
+    hostname = urlparse(url).hostname
+    if not hostname:
+        return None
+    return get_public_suffix_list().registrable_domain(hostname)
+
+
 def extract_domain_parts(url):
     """
     This is a helper function used to group URLs based on their domain patterns.
-    The function extracts the main domain, subdomain, and tld from a URL.
+    The function extracts the main domain, subdomain, and tld (the public suffix) from a URL.
+    The main domain of an IP address is the whole address.
     """
-    parsed = urlparse(url)
-    if not parsed.netloc:
+    hostname = urlparse(url).hostname
+    if not hostname:
         return None, None, None
-    
-    # Split domain into parts
-    parts = parsed.netloc.split('.')
-    
+    if is_ip_address(hostname):
+        return hostname, '', ''
+    domain = get_public_suffix_list().registrable_domain(hostname)
+    main_domain, _, tld = domain.partition('.')
+    subdomain = hostname.lower().rstrip('.')[:-len(domain)].rstrip('.')
     # Remove 'www' if present
-    if parts[0] == 'www':
-        parts = parts[1:]
-    
-    # Handle cases with subdomain
-    if len(parts) > 2:
-        subdomain = parts[0]
-        main_domain = parts[1]
-        tld = '.'.join(parts[2:])
-    else:
+    if subdomain == 'www':
         subdomain = ''
-        main_domain = parts[0]
-        tld = parts[1] if len(parts) > 1 else ''
-    
     return main_domain, subdomain, tld
 
+
 def group_urls(urls):
     """
     This is a helper function used to group URLs based on their domain patterns.
+    URLs are grouped by the name of their registrable domain, ignoring digits so similar domains
+    (e.g. company1.com and company.co.uk) end up in the same group. A name of digits only (e.g. 123.com) and
+    an IP address are kept whole. URLs without a domain go to 'Others'.
     """
     # Remove duplicates while maintaining order
     urls = list(dict.fromkeys(urls))
-    
-    # Initialize grouping structures
+
     domain_groups = defaultdict(list)
-    domain_info = {}
-    
-    # First pass: collect domain information
+    group_names = {}
+    remaining = []
     for url in urls:
-        main_domain, subdomain, tld = extract_domain_parts(url)
-        if main_domain:
-            domain_info[url] = {
-                'main_domain': main_domain,
-                'subdomain': subdomain,
-                'tld': tld,
-                'full_domain': f"{subdomain}.{main_domain}.{tld}" if subdomain else f"{main_domain}.{tld}"
-            }
-    # Find similar domain patterns
-    domain_patterns = defaultdict(list)
-    for url, info in domain_info.items():
-        main_domain = info['main_domain']
-        # Create a simplified version of the domain for pattern matching
-        simplified = re.sub(r'[0-9]', '', main_domain.lower())
-        domain_patterns[simplified].append(url)
-    # Group URLs based on patterns
-    for urls in domain_patterns.values():
-        if urls:
-            # Use the first URL's main domain as the group name
-            sample_info = domain_info[urls[0]]
-            group_name = sample_info['main_domain'].capitalize()
-            # Add all related URLs to this group
-            for url in urls:
-                domain_groups[group_name].append(url)
-    
+        main_domain, _, _ = extract_domain_parts(url)
+        if not main_domain:
+            remaining.append(url)
+            continue
+        # Create a simplified version of the domain for pattern matching,
+        # the first domain seen with a pattern names the group
+        simplified = main_domain if is_ip_address(main_domain) else re.sub(r'[0-9]', '', main_domain) or main_domain
+        group_name = group_names.setdefault(simplified, main_domain.capitalize())
+        domain_groups[group_name].append(url)
+
     # Add remaining URLs to 'Others' group
-    all_grouped = set(url for group in domain_groups.values() for url in group)
-    remaining = set(urls) - all_grouped
     if remaining:
-        domain_groups['Others'] = list(remaining)
-    
-    return dict(domain_groups)
\ No newline at end of file
+        domain_groups['Others'].extend(remaining)
+
+    return dict(domain_groups)
+
+
+def group_search_results(search_results, merge_similar=False, similarity_threshold=0.5):
+    """
+    Groups search results (SearchResults, see utils/state.py) by domain, largest group first.
+    The url to group index is built once, so every result is placed with a single lookup.
+
+    With merge_similar, groups on different domains whose content is near identical (estimated with
+    MinHash over word shingles) are merged, as they usually describe the same company. Groups without
+    content are never merged, there is nothing to compare.
+    """
+    url_groups = group_urls([result.url for result in search_results])
+    group_of_url = {url: name for name, urls in url_groups.items() for url in urls}
+
+    groups = defaultdict(list)
+    for result in search_results:
+        groups[group_of_url[result.url]].append(result)
+    groups = list(groups.values())
+
+    if merge_similar and len(groups) > 1:
+        texts = [" ".join(result.content for result in group) for group in groups]
+        comparable = [index for index, text in enumerate(texts) if shingles(text)]
+        signatures = [minhash(texts[index]) for index in comparable]
+        # Union find over the similar pairs, every group points to the group it was merged into
+        parent = list(range(len(groups)))
+        def find(index):
+            while parent[index] != index:
+                parent[index] = parent[parent[index]]
+                index = parent[index]
+            return index
+        for first, second in similar_pairs(signatures, similarity_threshold):
+            parent[find(comparable[second])] = find(comparable[first])
+        merged = defaultdict(list)
+        for index, group in enumerate(groups):
+            merged[find(index)].extend(group)
+        groups = list(merged.values())
+
+    return sorted(groups, key=len, reverse=True)